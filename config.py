@@ -1,5 +1,6 @@
 # config.py
 import os
+import hashlib
 
 # --- Secrets ---
 TOKEN = os.getenv("TOKEN")
@@ -28,4 +29,65 @@ SHOP_BANNER_URL = os.getenv("SHOP_BANNER_URL")
 
 # Anti-Spam
 SPAM_THRESHOLD_SECONDS = float(os.getenv("SPAM_THRESHOLD_SECONDS", "3.0"))
-SPAM_MESSAGE_LIMIT = int(os.getenv("SPAM_MESSAGE_LIMIT", "4"))
\ No newline at end of file
+SPAM_MESSAGE_LIMIT = int(os.getenv("SPAM_MESSAGE_LIMIT", "4"))
+
+# Message Stats (Write-Behind)
+# Per-message counters are buffered in memory and written in one bulk statement
+# every STATS_FLUSH_INTERVAL_MS milliseconds, or sooner once STATS_FLUSH_MAX_PENDING messages are waiting.
+STATS_FLUSH_INTERVAL_MS = int(os.getenv("STATS_FLUSH_INTERVAL_MS", "2000"))
+STATS_FLUSH_MAX_PENDING = int(os.getenv("STATS_FLUSH_MAX_PENDING", "500"))
+
+
+# User Registration
+# How many user IDs we remember as "already in the DB" (least recently seen are forgotten first)
+KNOWN_USERS_CACHE_SIZE = int(os.getenv("KNOWN_USERS_CACHE_SIZE", "50000"))
+
+# Admin Cache
+# Promotions/demotions are picked up live from ChatMember updates, so the full refetch can be rare
+ADMIN_CACHE_SECONDS = int(os.getenv("ADMIN_CACHE_SECONDS", "21600"))
+
+# System Config Sync
+# How often each process checks whether an admin changed the settings (seconds)
+CONFIG_POLL_SECONDS = float(os.getenv("CONFIG_POLL_SECONDS", "10"))
+
+# Leaderboard
+# The in-memory boards only see this process's writes. With several processes, reload them
+# from the DB at least this often (seconds). 0 = never (single process).
+LEADERBOARD_MAX_AGE = float(os.getenv("LEADERBOARD_MAX_AGE", "0"))
+
+# Captcha Pool
+# Ready-made captchas kept in memory so joins never wait for rendering
+CAPTCHA_POOL_DEPTH = int(os.getenv("CAPTCHA_POOL_DEPTH", "30"))
+CAPTCHA_POOL_WORKERS = int(os.getenv("CAPTCHA_POOL_WORKERS", "2"))
+CAPTCHA_REFILL_RATE = float(os.getenv("CAPTCHA_REFILL_RATE", "10"))  # captchas per second, max
+# Switch to cheaper captchas above this many joins per minute (3x this = cheapest tier),
+# or when a render takes longer than CAPTCHA_MAX_RENDER_LATENCY seconds
+CAPTCHA_RAID_JOINS_PER_MIN = int(os.getenv("CAPTCHA_RAID_JOINS_PER_MIN", "20"))
+CAPTCHA_MAX_RENDER_LATENCY = float(os.getenv("CAPTCHA_MAX_RENDER_LATENCY", "2.0"))
+# Upload size cap for animated captchas (bytes); fewer colours/frames are used to stay under it
+CAPTCHA_GIF_MAX_BYTES = int(os.getenv("CAPTCHA_GIF_MAX_BYTES", "20000"))
+
+# Optional: require ?token=... on the /metrics endpoint
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+
+# Outbound Rate Limits (Telegram: ~30 msg/s overall, ~20 msg/min per group, ~1 msg/s per private chat)
+SEND_GLOBAL_PER_SECOND = float(os.getenv("SEND_GLOBAL_PER_SECOND", "30"))
+SEND_GROUP_PER_MINUTE = float(os.getenv("SEND_GROUP_PER_MINUTE", "20"))
+SEND_PRIVATE_PER_SECOND = float(os.getenv("SEND_PRIVATE_PER_SECOND", "1"))
+SEND_MAX_RETRIES = int(os.getenv("SEND_MAX_RETRIES", "3"))  # Retries after a 429 before giving up
+
+# Admin Notifications
+ADMIN_NOTIFY_CONCURRENCY = int(os.getenv("ADMIN_NOTIFY_CONCURRENCY", "5"))  # Parallel sends across all admins
+# Hold admin notices this many seconds so close ones go out as one digest per admin (0 = send right away)
+ADMIN_DIGEST_SECONDS = float(os.getenv("ADMIN_DIGEST_SECONDS", "0"))
+
+# Webhook
+# Telegram puts this in the X-Telegram-Bot-Api-Secret-Token header (1-256 chars of A-Z a-z 0-9 _ -).
+# Defaults to a value derived from the bot token so it's stable across restarts.
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET") or (hashlib.sha256(TOKEN.encode()).hexdigest() if TOKEN else "")
+WEBHOOK_DEDUPE_SIZE = int(os.getenv("WEBHOOK_DEDUPE_SIZE", "10000"))  # Recent update_ids remembered
+WEBHOOK_QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", "1000"))  # Updates accepted but not yet handled before answering 503
+
+# Update Processing
+# Updates from different users handled at the same time (one user's updates always run in order)
+MAX_CONCURRENT_UPDATES = int(os.getenv("MAX_CONCURRENT_UPDATES", "32"))
\ No newline at end of file
@@ -1,5 +1,7 @@
 # database.py
 from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy import inspect, text, select, update
+from sqlalchemy.dialects import postgresql, sqlite
 import config
 from models.base import Base
 
@@ -9,6 +11,10 @@ from models.product import Product
 from models.referral import Referral
 from models.invite_link import InviteLink
 from models.settings import WelcomeConfig, SystemConfig
+from models.schema import SchemaVersion
+from models.verification import PendingVerification
+from models.deletion import ScheduledDeletion
+from models.outbox import OutboxMessage
 
 # Create the Async Engine
 engine = create_async_engine(config.DATABASE_URL, echo=False)
@@ -17,6 +23,52 @@ engine = create_async_engine(config.DATABASE_URL, echo=False)
 AsyncSessionLocal = async_sessionmaker(bind=engine, expire_on_commit=False)
 
 async def init_db():
-    """Asynchronously creates all tables if they don't exist."""
+    """Asynchronously creates all tables if they don't exist, then applies pending migrations."""
     async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
\ No newline at end of file
+        if conn.dialect.name == 'postgresql':
+            # Two replicas booting at once must not create tables or migrate at the same time
+            await conn.execute(text("SELECT pg_advisory_xact_lock(4242)"))
+        await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(_run_migrations)
+
+# --- SCHEMA MIGRATIONS ---
+# create_all only creates missing tables, it never changes existing ones.
+# Anything added to an existing table goes here as a numbered step.
+# Every step must also be safe on a fresh DB that create_all just built.
+
+def _add_system_config_version(conn):
+    """system_config.version (cross-process config cache)"""
+    existing = {col['name'] for col in inspect(conn).get_columns('system_config')}
+    if 'version' not in existing:
+        conn.execute(text("ALTER TABLE system_config ADD COLUMN version INTEGER DEFAULT 0"))
+
+def _create_hot_query_indexes(conn):
+    """indexes for leaderboard sorts, product menus, referrals and invite links"""
+    for table in (User.__table__, Product.__table__, Referral.__table__, InviteLink.__table__):
+        for index in table.indexes:
+            index.create(conn, checkfirst=True)
+
+MIGRATIONS = [
+    (1, _add_system_config_version),
+    (2, _create_hot_query_indexes),
+]
+
+def _run_migrations(conn):
+    current = conn.execute(select(SchemaVersion.version).filter_by(id=1)).scalar()
+    if current is None:
+        conn.execute(SchemaVersion.__table__.insert().values(id=1, version=0))
+        current = 0
+
+    for version, migrate in MIGRATIONS:
+        if version > current:
+            migrate(conn)
+            conn.execute(update(SchemaVersion).filter_by(id=1).values(version=version))
+            print(f"🛠 Applied schema migration {version}: {migrate.__doc__}")
+
+def insert_ignore(model):
+    """
+    INSERT ... ON CONFLICT DO NOTHING for whichever database we are running on
+    (PostgreSQL on Railway, SQLite for local testing).
+    """
+    dialect_insert = postgresql.insert if engine.dialect.name == 'postgresql' else sqlite.insert
+    return dialect_insert(model).on_conflict_do_nothing()
\ No newline at end of file
@@ -1,5 +1,32 @@
-from telegram.ext import MessageHandler, CommandHandler, CallbackQueryHandler, filters, ChatMemberHandler
-from . import economy, admin, admin_products, redemption, verification, admin_welcome, shop, scratchers, invitation, leaderboard
+from telegram import Update
+from telegram.ext import MessageHandler, CommandHandler, CallbackQueryHandler, filters, ChatMemberHandler, ConversationHandler
+from . import economy, admin, admin_products, redemption, verification, admin_welcome, shop, scratchers, invitation, leaderboard, moderation
+
+# --- TEXT COMMANDS ---
+# Exact-match keywords typed in chat. Keys are normalized (see _normalize_command).
+TEXT_COMMANDS = {
+    '专属链接': invitation.request_invite_link,
+    '积分': economy.check_balance,
+    '排名': leaderboard.show_leaderboard,
+    '签到': economy.handle_check_in_request,
+    'checkin': economy.handle_check_in_request,
+    '付费抽奖': redemption.open_lottery_menu,
+    '积分商店': shop.open_shop_menu,
+    '娱乐抽奖': scratchers.open_scratcher_menu,
+}
+
+def _normalize_command(text: str) -> str:
+    return text.strip().lower()
+
+class _TextCommandFilter(filters.MessageFilter):
+    """Matches messages whose whole text is one of TEXT_COMMANDS. Anything else falls through."""
+    def filter(self, message) -> bool:
+        return message.text is not None and _normalize_command(message.text) in TEXT_COMMANDS
+
+_text_command_filter = _TextCommandFilter(name='TextCommand')
+
+async def route_text_command(update, context):
+    await TEXT_COMMANDS[_normalize_command(update.effective_message.text)](update, context)
 
 def register_handlers(application):
     """
@@ -11,6 +38,7 @@ def register_handlers(application):
     application.add_handler(CallbackQueryHandler(verification.verify_button_click, pattern="^verify_"))
 
     application.add_handler(ChatMemberHandler(invitation.track_join_event, ChatMemberHandler.CHAT_MEMBER), group=1)
+    application.add_handler(ChatMemberHandler(moderation.track_admin_changes, ChatMemberHandler.CHAT_MEMBER), group=2)
     
     # 2. Admin Wizards (Conversation Handlers)
     application.add_handler(admin_welcome.welcome_conv_handler)
@@ -31,16 +59,45 @@ def register_handlers(application):
     application.add_handler(CallbackQueryHandler(admin_products.handle_remove_product, pattern="^admin_delete_prod_"))
     application.add_handler(CallbackQueryHandler(admin.admin_callback, pattern="^admin_"))
 
-    # 4. Economy & Games
-    application.add_handler(MessageHandler(filters.Regex(r'^专属链接$'), invitation.request_invite_link))
-    application.add_handler(MessageHandler(filters.Regex(r'^积分$'), economy.check_balance))
-    application.add_handler(MessageHandler(filters.Regex(r'^排名$'), leaderboard.show_leaderboard))
-    application.add_handler(MessageHandler(filters.Regex(r'(?i)^(签到|checkin)$'), economy.handle_check_in_request))
-    application.add_handler(MessageHandler(filters.Regex(r'^付费抽奖$'), redemption.open_lottery_menu))
-    application.add_handler(MessageHandler(filters.Regex(r'^积分商店$'), shop.open_shop_menu))
-    application.add_handler(MessageHandler(filters.Regex(r'^娱乐抽奖$'), scratchers.open_scratcher_menu))
+    # 4. Economy & Games (one dict lookup for all text commands, see TEXT_COMMANDS)
+    application.add_handler(MessageHandler(_text_command_filter, route_text_command))
 
     application.add_handler(CallbackQueryHandler(leaderboard.leaderboard_callback, pattern="^lb_"))
     application.add_handler(CallbackQueryHandler(redemption.handle_lottery_draw, pattern="^lottery_draw_"))
     application.add_handler(CallbackQueryHandler(shop.handle_shop_buy, pattern="^shop_buy"))
     application.add_handler(CallbackQueryHandler(scratchers.handle_scratcher_play, pattern="^scratcher_play_"))
+
+# --- UPDATE SUBSCRIPTION MANIFEST ---
+# Which Telegram update types each kind of handler consumes. Every message handler here
+# reads update.message, so edits, channel posts etc. would only be thrown away later.
+_CHAT_MEMBER_TYPES = {
+    ChatMemberHandler.MY_CHAT_MEMBER: [Update.MY_CHAT_MEMBER],
+    ChatMemberHandler.CHAT_MEMBER: [Update.CHAT_MEMBER],
+    ChatMemberHandler.ANY_CHAT_MEMBER: [Update.MY_CHAT_MEMBER, Update.CHAT_MEMBER],
+}
+
+def _handler_update_types(handler) -> list:
+    if isinstance(handler, ConversationHandler):
+        nested = list(handler.entry_points) + list(handler.fallbacks)
+        for state_handlers in handler.states.values():
+            nested += state_handlers
+        return [t for h in nested for t in _handler_update_types(h)]
+    if isinstance(handler, (MessageHandler, CommandHandler)):
+        return [Update.MESSAGE]
+    if isinstance(handler, CallbackQueryHandler):
+        return [Update.CALLBACK_QUERY]
+    if isinstance(handler, ChatMemberHandler):
+        return _CHAT_MEMBER_TYPES[handler.chat_member_types]
+    # Unknown handler type: don't guess, subscribe to everything
+    return list(Update.ALL_TYPES)
+
+def allowed_updates(application) -> list:
+    """
+    The update types the registered handlers can actually use.
+    Passed to set_webhook so Telegram doesn't send the rest, and used by the webhook's raw pre-filter.
+    """
+    types = set()
+    for group_handlers in application.handlers.values():
+        for handler in group_handlers:
+            types.update(_handler_update_types(handler))
+    return sorted(str(t) for t in types)
\ No newline at end of file
@@ -4,6 +4,7 @@ from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes, ConversationHandler, CommandHandler, MessageHandler, CallbackQueryHandler, filters
 from sqlalchemy import select
 from database import AsyncSessionLocal, Product
+from services import wheel
 from utils.decorators import admin_only, private_chat_only
 
 # Steps
@@ -113,6 +114,7 @@ async def receive_stock(update: Update, context: ContextTypes.DEFAULT_TYPE):
             )
             session.add(new_prod)
             await session.commit()
+        wheel.invalidate()
         
         keyboard = [[InlineKeyboardButton("🔙 返回控制面板", callback_data="admin_home")]]
         await update.message.reply_text(f"✅ {data['type'].title()} 商品已添加！\n{data['name']}", 
@@ -180,6 +182,7 @@ async def handle_remove_product(update: Update, context: ContextTypes.DEFAULT_TY
             name = product.name
             await session.delete(product)
             await session.commit()
+            wheel.invalidate()
             await query.answer(f"✅ 删除: {name}", show_alert=True)
         else:
             await query.answer("❌ 商品已删除.", show_alert=True)
@@ -16,26 +16,27 @@ async def track_activity(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # 1. Ensure user exists in DB
     await economy.get_or_create_user(user.id, user.username, user.first_name)
     
-    # 2. Update Message Count
-    new_msg_count = await economy.increment_stats(user.id)
+    # 2. Invite reward check (fires once the user's total crosses the milestone)
+    chat_id = update.effective_chat.id
 
-    if new_msg_count == 50:
+    async def reward_invite():
         from handlers import invitation
-        await invitation.check_and_reward_invite(user, update.effective_chat.id, context)
-    
-    # 3. Check Shadow Mute (Admin Penalty)
-    if antispam.is_shadow_muted(user.id):
-        return # No points for bad admins!
+        await invitation.check_and_reward_invite(user, chat_id, context)
 
-    # 4. Award Points (With Daily Limit Check)
+    # 3. Roll for points first (Shadow Muted admins never earn any)
     sys_config = await economy.get_system_config()
     max_daily_points = sys_config.get('max_daily_points', 100)
 
     CHANCE = 0.20
-    roll = random.random()
-    if roll < CHANCE:
-        # Use our new secure function that respects the daily limit!
-        await economy.award_chat_points(user.id, 1.0, max_daily_points)
+    earns_points = not antispam.is_shadow_muted(user.id) and random.random() < CHANCE
+
+    # 4. Count the message
+    if earns_points:
+        # Counter + capped point award in one UPDATE
+        await economy.record_message_with_points(user.id, 1.0, max_daily_points, on_milestone=reward_invite)
+    else:
+        # Plain message: buffered and written in bulk
+        economy.increment_stats(user.id, on_milestone=reward_invite)
 
 async def check_balance(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """
@@ -77,9 +78,4 @@ async def handle_check_in_request(update: Update, context: ContextTypes.DEFAULT_
         
     # MODIFIED: Schedule auto-delete after 20 seconds
     if reply_msg:
-        context.job_queue.run_once(
-            cleaner.delete_message_job,
-            20,
-            data={'chat_id': reply_msg.chat_id, 'message_id': reply_msg.message_id},
-            name=f"del_checkin_{reply_msg.chat_id}_{reply_msg.message_id}"
-        )
\ No newline at end of file
+        cleaner.schedule_deletion(reply_msg.chat_id, reply_msg.message_id, 20)
\ No newline at end of file
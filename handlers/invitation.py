@@ -11,6 +11,9 @@ from models.referral import Referral
 from models.invite_link import InviteLink
 from models.user import User
 from services import economy
+from services.verification import VERIFICATION_TIMEOUT
+from utils.timer_wheel import expiry_wheel
+from utils.rate_limiter import NOTIFICATION
 
 # Store pending invites in memory until the user passes verification
 # Format: {invited_user_id: inviter_user_id}
@@ -175,6 +178,8 @@ async def track_join_event(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 return
             
             _pending_invites[user.id] = inviter_id
+            # Dropped automatically if the user never finishes verification
+            expiry_wheel.expire_after(_pending_invites, user.id, VERIFICATION_TIMEOUT + 60)
 
         except Exception as e:
             print(f"Referral Tracking Error: {e}")
@@ -250,5 +255,6 @@ async def check_and_reward_invite(invited_user, chat_id, context: ContextTypes.D
             text=f"📢 <b>邀请奖励发放!</b>\n"
                  f"🎉 {invited_user.mention_html()} 成功满足条件！\n"
                  f"💰 邀请人 {mention_html(inviter_id, inviter_name)} 获得 <b>{reward_points}</b> 积分",
-            parse_mode='HTML'
+            parse_mode='HTML',
+            rate_limit_args=NOTIFICATION
         )
\ No newline at end of file
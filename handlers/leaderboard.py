@@ -1,13 +1,25 @@
 # ruanbot/handlers/leaderboard.py
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
-from services import economy
+from telegram.error import BadRequest
+from services import ranking
+from utils.lru import LRUCache
+from utils.timer_wheel import expiry_wheel
 import math
 
 # Constants
 ITEMS_PER_PAGE = 10
 MAX_ITEMS = 30
 
+# Rendered pages, shared by everyone paging through the same board.
+# Format: {(sort_by, page, board_version): (text, reply_markup)}
+_page_cache = {}
+PAGE_CACHE_TTL = 30  # seconds
+
+# Which page each leaderboard message is currently showing.
+# Format: {(chat_id, message_id): (sort_by, page, board_version)}
+_shown_pages = LRUCache(maxsize=2000)
+
 async def show_leaderboard(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """
     Entry point for /rank or 排名
@@ -30,29 +42,24 @@ async def leaderboard_callback(update: Update, context: ContextTypes.DEFAULT_TYP
     await render_leaderboard(update, page, sort_by, is_new=False)
     await query.answer()
 
-async def render_leaderboard(update: Update, page: int, sort_by: str, is_new: bool):
+async def _build_page(page: int, sort_by: str):
     """
-    Generates the text and keyboard, then sends or edits the message.
+    Generates the text and keyboard for one page. Returns (text, reply_markup).
     """
     # 1. Calculate Offsets
     start_idx = page * ITEMS_PER_PAGE
 
-    # 2. Fetch EXACTLY 10 users from the DB (Super Fast!)
-    page_users = await economy.get_leaderboard(sort_by=sort_by, limit=ITEMS_PER_PAGE, offset=start_idx)
+    # 2. Fetch EXACTLY 10 users from the in-memory board (no DB query)
+    page_users = await ranking.get_leaderboard(sort_by=sort_by, limit=ITEMS_PER_PAGE, offset=start_idx)
     
     # 3. Fetch Total Pages
-    total_users = await economy.get_total_ranked_users(max_limit=MAX_ITEMS)
+    total_users = await ranking.get_total_ranked_users(max_limit=MAX_ITEMS)
     total_pages = math.ceil(total_users / ITEMS_PER_PAGE)
     if total_pages == 0: total_pages = 1
     
     # Handle empty DB
     if not page_users and page == 0:
-        text = "📊 还没有用户数据!"
-        if is_new:
-            await update.message.reply_text(text)
-        else:
-            await update.callback_query.edit_message_text(text)
-        return
+        return "📊 还没有用户数据!", None
     
     # 4. Build Text
     title = "🏆 积分排行榜" if sort_by == 'points' else "🗣 日活跃榜"
@@ -127,8 +134,35 @@ async def render_leaderboard(update: Update, page: int, sort_by: str, is_new: bo
     
     reply_markup = InlineKeyboardMarkup(keyboard)
     
-    # 6. Send
+    return text, reply_markup
+
+async def render_leaderboard(update: Update, page: int, sort_by: str, is_new: bool):
+    """
+    Sends or edits the leaderboard message, reusing recently rendered pages.
+    """
+    key = (sort_by, page, await ranking.get_version(sort_by))
+
+    rendered = _page_cache.get(key)
+    if rendered is None:
+        rendered = await _build_page(page, sort_by)
+        _page_cache[key] = rendered
+        expiry_wheel.expire_after(_page_cache, key, PAGE_CACHE_TTL)
+    text, reply_markup = rendered
+
+    # Send
     if is_new:
-        await update.message.reply_text(text, reply_markup=reply_markup, parse_mode='HTML')
-    else:
-        await update.callback_query.edit_message_text(text, reply_markup=reply_markup, parse_mode='HTML')
\ No newline at end of file
+        sent = await update.message.reply_text(text, reply_markup=reply_markup, parse_mode='HTML')
+        _shown_pages.put((sent.chat_id, sent.message_id), key)
+        return
+
+    message = update.callback_query.message
+    shown_key = (message.chat_id, message.message_id)
+    if _shown_pages.get(shown_key) == key:
+        return # Same content: Telegram would only answer "message is not modified"
+
+    try:
+        await update.callback_query.edit_message_text(text, reply_markup=reply_markup, parse_mode='HTML')
+    except BadRequest as e:
+        if "not modified" not in str(e):
+            raise
+    _shown_pages.put(shown_key, key)
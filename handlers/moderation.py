@@ -3,7 +3,7 @@ from telegram import Update, ChatPermissions
 from telegram.ext import ContextTypes
 from datetime import datetime, timedelta
 from services import antispam, economy
-from utils.admin_cache import is_user_admin
+from utils.admin_cache import is_user_admin, apply_member_update
 
 async def check_spam(update: Update, context: ContextTypes.DEFAULT_TYPE) -> bool:
     """
@@ -60,4 +60,12 @@ async def check_spam(update: Update, context: ContextTypes.DEFAULT_TYPE) -> bool
         
         return True # Stop other handlers
     
-    return False # Safe to proceed
\ No newline at end of file
+    return False # Safe to proceed
+
+async def track_admin_changes(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    Triggered on every ChatMember update.
+    Keeps the admin cache in sync with promotions and demotions without refetching.
+    """
+    if update.chat_member:
+        apply_member_update(update.chat_member)
@@ -3,6 +3,7 @@ from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, WebAppI
 from telegram.ext import ContextTypes
 from database import AsyncSessionLocal, Product, User
 from sqlalchemy import select
+from services import outbox, wheel
 import random
 
 WEB_APP_URL = "https://ruanbot-production.up.railway.app"
@@ -47,6 +48,7 @@ async def handle_lottery_draw(update: Update, context: ContextTypes.DEFAULT_TYPE
     user = query.from_user
     product_id = int(query.data.split("_")[2])
     
+    # Decide everything inside the transaction, talk to Telegram only after it has closed
     async with AsyncSessionLocal() as session:
         result_user = await session.execute(select(User).filter_by(id=user.id).with_for_update())
         db_user = result_user.scalars().first()
@@ -56,25 +58,26 @@ async def handle_lottery_draw(update: Update, context: ContextTypes.DEFAULT_TYPE
         product = result_prod.scalars().first()
         
         if not product or product.stock <= 0:
-            await query.answer("❌ 现在无抽奖", show_alert=True)
-            return
-
-        cost = int(product.cost)
-        if not db_user or db_user.vouchers < cost:
-            await query.answer(f"❌ 需要 {cost} 兑奖券! 您有 {db_user.vouchers if db_user else 0}.", show_alert=True)
-            return
-
-        db_user.vouchers -= cost
-        
-        if random.random() < product.chance:
-            product.stock -= 1
-            await session.commit()
-            await context.bot.send_message(
-                chat_id=query.message.chat_id,
-                text=f"🎉 中奖!!!!!🎉 {user.mention_html()} 花费 {cost} 兑奖券并赢得了 {product.name}!",
-                parse_mode='HTML'
-            )
-            await query.answer("🎉 中奖!!!!!", show_alert=True)
+            alert = "❌ 现在无抽奖"
+        elif not db_user or db_user.vouchers < int(product.cost):
+            alert = f"❌ 需要 {int(product.cost)} 兑奖券! 您有 {db_user.vouchers if db_user else 0}."
         else:
+            cost = int(product.cost)
+            stock_before = product.stock
+            db_user.vouchers -= cost
+            
+            if random.random() < product.chance:
+                product.stock -= 1
+                # Sent by the outbox once this commits
+                outbox.enqueue(session, query.message.chat_id,
+                    f"🎉 中奖!!!!!🎉 {user.mention_html()} 花费 {cost} 兑奖券并赢得了 {product.name}!"
+                )
+                alert = "🎉 中奖!!!!!"
+            else:
+                alert = "📉 本次没有中奖。再试一次!"
             await session.commit()
-            await query.answer("📉 本次没有中奖。再试一次!", show_alert=True)
\ No newline at end of file
+            outbox.wake()
+            if product.stock != stock_before:
+                wheel.invalidate() # The wheel shows stock-filtered products
+
+    await query.answer(alert, show_alert=True)
\ No newline at end of file
@@ -3,8 +3,8 @@ from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
 from database import AsyncSessionLocal, Product, User
 from sqlalchemy import select
+from services import ranking, outbox
 import random
-import config
 
 async def open_scratcher_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Shows only SCRATCHER items (Cost = Points)."""
@@ -33,6 +33,7 @@ async def handle_scratcher_play(update: Update, context: ContextTypes.DEFAULT_TY
     user = query.from_user
     product_id = int(query.data.split("_")[2])
     
+    # Decide everything inside the transaction, talk to Telegram only after it has closed
     async with AsyncSessionLocal() as session:
         result_user = await session.execute(select(User).filter_by(id=user.id).with_for_update())        
         db_user = result_user.scalars().first()
@@ -42,39 +43,32 @@ async def handle_scratcher_play(update: Update, context: ContextTypes.DEFAULT_TY
         product = result_prod.scalars().first()
         
         if not product or product.stock <= 0:
-            await query.answer("❌ 库存不足或商品已下架!", show_alert=True)
-            return
-
-        cost = int(product.cost)
-        if not db_user or db_user.points < cost:
-            await query.answer(f"❌ 需要 {cost} 积分! 您有 {int(db_user.points) if db_user else 0}.", show_alert=True)
-            return
-
-        db_user.points -= cost
-        
-        if random.random() < product.chance:
-            product.stock -= 1
-            if product.stock <= 0:
-                await session.delete(product)
-            await session.commit()
-            if config.ADMIN_IDS:
-                notify_msg = (
+            alert = "❌ 库存不足或商品已下架!"
+        elif not db_user or db_user.points < int(product.cost):
+            alert = f"❌ 需要 {int(product.cost)} 积分! 您有 {int(db_user.points) if db_user else 0}."
+        else:
+            cost = int(product.cost)
+            db_user.points -= cost
+            
+            if random.random() < product.chance:
+                product.stock -= 1
+                if product.stock <= 0:
+                    await session.delete(product)
+                # Sent by the outbox once this commits
+                outbox.enqueue_admin_notice(session,
                     f"🃏 刮刮乐中奖通知\n"
                     f"👤 用户: <a href='tg://user?id={user.id}'>{user.full_name}</a> (<code>{user.id}</code>)\n"
                     f"🎁 赢取: {product.name}\n"
                     f"💰 花费: {cost} 积分"
                 )
-                for admin_id in config.ADMIN_IDS:
-                    try:
-                        await context.bot.send_message(chat_id=admin_id, text=notify_msg, parse_mode='HTML')
-                    except Exception as e:
-                        print(f"Could not notify admin {admin_id}: {e}")
-            await context.bot.send_message(
-                chat_id=query.message.chat_id,
-                text=f"🎉 中奖啦!!</b> 🎉\n\n{user.mention_html()} 刮开了一张卡片并赢得了: \n**{product.name}**!",
-                parse_mode='HTML'
-            )
-            await query.answer("🎉 恭喜中奖!!!!!", show_alert=True)
-        else:
+                outbox.enqueue(session, query.message.chat_id,
+                    f"<b>🎉 中奖啦!!</b> 🎉\n\n{user.mention_html()} 刮开了一张卡片并赢得了: \n<b>{product.name}</b>!"
+                )
+                alert = "🎉 恭喜中奖!!!!!"
+            else:
+                alert = "📉 很遗憾，没有刮中。再试一次吧!"
             await session.commit()
-            await query.answer("📉 很遗憾，没有刮中。再试一次吧!", show_alert=True)
\ No newline at end of file
+            ranking.record(db_user.id, db_user.full_name, points=db_user.points)
+            outbox.wake()
+
+    await query.answer(alert, show_alert=True)
\ No newline at end of file
@@ -3,7 +3,7 @@ from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
 from database import AsyncSessionLocal, Product, User
 from sqlalchemy import select
-from services import economy
+from services import economy, ranking, outbox
 import config
 
 async def open_shop_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -77,69 +77,75 @@ async def handle_shop_buy(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = query.from_user
     data = query.data
     
-    async with AsyncSessionLocal() as session:
-        result_user = await session.execute(select(User).filter_by(id=user.id).with_for_update())
-        db_user = result_user.scalars().first()
-        if not db_user: return
-        
-        # A. Buying a Voucher
-        if data == "shop_buy_voucher":
-            # Check if enabled
-            if not await economy.is_voucher_buy_enabled():
-                await query.answer("❌ 兑奖券购买功能已禁用!", show_alert=True)
-                await open_shop_menu(update, context) # Refresh to update UI
-                return
+    # A. Buying a Voucher
+    if data == "shop_buy_voucher":
+        # Check if enabled
+        if not await economy.is_voucher_buy_enabled():
+            await query.answer("❌ 兑奖券购买功能已禁用!", show_alert=True)
+            await open_shop_menu(update, context) # Refresh to update UI
+            return
 
-            v_price = await economy.get_voucher_cost()
+        v_price = await economy.get_voucher_cost()
+        bought = False
+        async with AsyncSessionLocal() as session:
+            result_user = await session.execute(select(User).filter_by(id=user.id).with_for_update())
+            db_user = result_user.scalars().first()
+            if not db_user: return
             if db_user.points >= v_price:
                 db_user.points -= v_price
                 db_user.vouchers += 1
                 await session.commit()
-                await query.answer("✅ 兑奖券购买成功!", show_alert=True)
-                await open_shop_menu(update, context) 
-            else:
-                await query.answer(f"❌ 需要 {v_price} 积分!", show_alert=True)
-            return
+                ranking.record(db_user.id, db_user.full_name, points=db_user.points)
+                bought = True
+
+        # Lock released: now it's safe to talk to Telegram (and for the menu to open its own session)
+        if bought:
+            await query.answer("✅ 兑奖券购买成功!", show_alert=True)
+            await open_shop_menu(update, context) 
+        else:
+            await query.answer(f"❌ 需要 {v_price} 积分!", show_alert=True)
+        return
 
-        # B. Buying a Product
-        product_id = int(data.split("_")[2])
+    # B. Buying a Product
+    product_id = int(data.split("_")[2])
+    bought = False
+    
+    async with AsyncSessionLocal() as session:
+        result_user = await session.execute(select(User).filter_by(id=user.id).with_for_update())
+        db_user = result_user.scalars().first()
+        if not db_user: return
         
         # Atomic Check (prevent race conditions)
         result_prod = await session.execute(select(Product).filter_by(id=product_id).with_for_update())
         product = result_prod.scalars().first()
         
         if not product or product.stock <= 0:
-            await query.answer("❌ 库存不足!", show_alert=True)
-            return
-            
-        cost = int(product.cost)
-        if db_user.points >= cost:
+            alert = "❌ 库存不足!"
+        elif db_user.points < int(product.cost):
+            alert = f"❌ 需要 {int(product.cost)} 积分!"
+        else:
+            cost = int(product.cost)
             db_user.points -= cost
             product.stock -= 1
             if product.stock <= 0:
                 await session.delete(product)
-            await session.commit()
 
-            #ADMIN NOTIFICATION BLOCK
-            if config.ADMIN_IDS:
-                notify_msg = (
-                    f"🛍 商店购买通知\n"
-                    f"👤 用户: <a href='tg://user?id={user.id}'>{user.full_name}</a> (<code>{user.id}</code>)\n"
-                    f"🎁 兑换: {product.name}\n"
-                    f"💰 花费: {cost} 积分"
-                )
-                for admin_id in config.ADMIN_IDS:
-                    try:
-                        await context.bot.send_message(chat_id=admin_id, text=notify_msg, parse_mode='HTML')
-                    except Exception as e:
-                        print(f"Could not notify admin {admin_id}: {e}")
-            
-            await context.bot.send_message(
-                chat_id=query.message.chat_id,
-                text=f"🛒 购买成功 \n{user.mention_html()},{product.name} 花费 {cost} 积分",
-                parse_mode='HTML'
+            # Sent by the outbox once this commits
+            outbox.enqueue_admin_notice(session,
+                f"🛍 商店购买通知\n"
+                f"👤 用户: <a href='tg://user?id={user.id}'>{user.full_name}</a> (<code>{user.id}</code>)\n"
+                f"🎁 兑换: {product.name}\n"
+                f"💰 花费: {cost} 积分"
             )
-            await query.answer("✅ 购买成功!", show_alert=True)
-            await query.message.delete()
-        else:
-            await query.answer(f"❌ 需要 {cost} 积分!", show_alert=True)
\ No newline at end of file
+            outbox.enqueue(session, query.message.chat_id,
+                f"🛒 购买成功 \n{user.mention_html()},{product.name} 花费 {cost} 积分"
+            )
+            await session.commit()
+            ranking.record(db_user.id, db_user.full_name, points=db_user.points)
+            outbox.wake()
+            alert = "✅ 购买成功!"
+            bought = True
+
+    await query.answer(alert, show_alert=True)
+    if bought:
+        await query.message.delete()
\ No newline at end of file
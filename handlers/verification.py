@@ -3,7 +3,7 @@ import time
 import asyncio
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, ChatPermissions, ChatMember
 from telegram.ext import ContextTypes
-from services import verification, cleaner
+from services import verification, cleaner, ranking
 from database import AsyncSessionLocal, User, WelcomeConfig
 from sqlalchemy import select
 from handlers.invitation import register_verified_invite, clear_pending_invite
@@ -71,8 +71,8 @@ async def welcome_new_member(update: Update, context: ContextTypes.DEFAULT_TYPE)
         print(f"⚠️ Warning: Could not mute {user.full_name} (Likely Admin/Owner): {e}")
         pass 
 
-    # 4. Generate Challenge
-    gif_data, answers = await asyncio.to_thread(verification.generate_gif_captcha, user.id)
+    # 4. Take a pre-rendered Challenge from the pool
+    captcha_data, answers, captcha_format = await verification.issue_captcha(user.id)
 
     # 5. Build Math Buttons
     keyboard = []
@@ -86,38 +86,59 @@ async def welcome_new_member(update: Update, context: ContextTypes.DEFAULT_TYPE)
     
     reply_markup = InlineKeyboardMarkup(keyboard)
     
-    # 6. Send the GIF Captcha (Using send_animation instead of send_message)
+    # 6. Send the Captcha (animated GIF normally, a static PNG during raids)
+    caption = (f"🛑 欢迎加入, {user.mention_html()}!\n\n"
+               f"🛡 请完成验证\n"
+               f"请在三分钟内选择与上方图片中一致的 4 个字符，以验证你是人类:")
     try:
-        captcha_msg = await context.bot.send_animation(
-            chat_id=chat.id,
-            animation=gif_data, # Send our in-memory GIF
-            caption=f"🛑 欢迎加入, {user.mention_html()}!\n\n"
-                 f"🛡 请完成验证\n"
-                 f"请在三分钟内选择与上方动图中一致的 4 个字符，以验证你是人类:",
-            reply_markup=reply_markup,
-            parse_mode='HTML'
-        )
+        if captcha_format == 'png':
+            captcha_msg = await context.bot.send_photo(
+                chat_id=chat.id,
+                photo=captcha_data,
+                caption=caption,
+                reply_markup=reply_markup,
+                parse_mode='HTML'
+            )
+        else:
+            captcha_msg = await context.bot.send_animation(
+                chat_id=chat.id,
+                animation=captcha_data, # Send our in-memory GIF
+                caption=caption,
+                reply_markup=reply_markup,
+                parse_mode='HTML'
+            )
 
-        # 7. Start 3-Minute Timeout
-        async def timeout_kick(chat_id, user_id, message_id):
-            await asyncio.sleep(180) 
-            # Verify pending status
-            if verification.get_verification(user_id):
-                verification.clear_verification(user_id)
-                clear_pending_invite(user_id)
-                try:
-                    await context.bot.ban_chat_member(chat_id, user_id)
-                    await context.bot.unban_chat_member(chat_id, user_id)
-                    await context.bot.delete_message(chat_id, message_id)
-                except:
-                    pass
-        
-        # Schedule the task
-        context.application.create_task(timeout_kick(chat.id, user.id, captcha_msg.message_id))
+        # 7. Start 3-Minute Timeout (kicked by the expire_verifications job, even across restarts)
+        await verification.save_verification(user.id, chat.id, captcha_msg.message_id)
         
     except Exception as e:
         print(f"❌ Failed to send captcha message: {e}")
 
+async def expire_verifications(context: ContextTypes.DEFAULT_TYPE):
+    """
+    Job: kicks everyone whose captcha timed out, earliest first, one batch at a time.
+    Replaces the per-join sleeping task, so a raid costs table rows instead of live coroutines.
+    """
+    await verification.save_unsaved_verifications()
+    while True:
+        expired = await verification.claim_expired_verifications()
+        if not expired:
+            return
+
+        async def kick(user_id, chat_id, message_id):
+            clear_pending_invite(user_id)
+            try:
+                await context.bot.ban_chat_member(chat_id, user_id)
+                await context.bot.unban_chat_member(chat_id, user_id)
+                if message_id:
+                    await context.bot.delete_message(chat_id, message_id)
+            except:
+                pass
+
+        await asyncio.gather(*(kick(*row) for row in expired))
+        if len(expired) < verification.EXPIRY_BATCH_SIZE:
+            return
+
 async def verify_button_click(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Triggered when someone clicks the math answers."""
     query = update.callback_query
@@ -141,7 +162,7 @@ async def verify_button_click(update: Update, context: ContextTypes.DEFAULT_TYPE
     correct_answer = v_data['correct']
     
     # Clear memory
-    verification.clear_verification(target_user_id)
+    await verification.clear_verification(target_user_id)
     
     # --- RULE 1: Anti-Bot Check (< 1 second) ---
     if time_taken < 1.0:
@@ -174,7 +195,8 @@ async def verify_button_click(update: Update, context: ContextTypes.DEFAULT_TYPE
                 result_user = await session.execute(select(User).filter_by(id=target_user_id))
                 db_user = result_user.scalars().first()
                 if not db_user:
-                    db_user = User(id=clicker.id, username=clicker.username, full_name=clicker.first_name, is_verified=True)
+                    db_user = User(id=clicker.id, username=clicker.username, full_name=clicker.first_name, is_verified=True,
+                                   points=0.0, msg_count_daily=0)
                     session.add(db_user)
                 else:
                     db_user.is_verified = True
@@ -192,6 +214,7 @@ async def verify_button_click(update: Update, context: ContextTypes.DEFAULT_TYPE
                     }
                 
                 await session.commit()
+                ranking.record(db_user.id, db_user.full_name, points=db_user.points, msg_count_daily=db_user.msg_count_daily)
 
             # 3. Clean up Captcha
             await query.answer("✅ 验证成功! 你现在可以聊天了.", show_alert=True)
@@ -224,12 +247,7 @@ async def verify_button_click(update: Update, context: ContextTypes.DEFAULT_TYPE
             
             # 5. Auto-delete welcome message
             if welcome_msg:
-                context.job_queue.run_once(
-                    cleaner.delete_message_job,
-                    50,
-                    data={'chat_id': welcome_msg.chat_id, 'message_id': welcome_msg.message_id},
-                    name=f"del_welcome_{welcome_msg.chat_id}_{welcome_msg.message_id}"
-                )
+                cleaner.schedule_deletion(welcome_msg.chat_id, welcome_msg.message_id, 50)
             await register_verified_invite(clicker, context)
 
         except Exception as e:
@@ -5,14 +5,17 @@ from database import init_db
 from telegram import Update
 from telegram.ext import ApplicationBuilder, MessageHandler, filters, ApplicationHandlerStop
 from telegram.request import HTTPXRequest
-from handlers import register_handlers
-from handlers import moderation, economy as economy_handler
-from services.antispam import cleanup_cache
-from services import cleaner, economy as economy_service
+from handlers import register_handlers, allowed_updates
+from handlers import moderation, economy as economy_handler, verification as verification_handler
+from utils.timer_wheel import advance_expiry_wheel
+from utils.rate_limiter import OutboundRateLimiter
+from utils.update_processor import UserOrderedUpdateProcessor
+from services import cleaner, ranking, outbox, economy as economy_service, verification as verification_service
 from datetime import time
-from webapp_server import start_web_server
+from webapp_server import start_web_server, stop_web_server
 import aiohttp
 import os
+import signal
 import asyncio
 
 # Logging Setup
@@ -52,6 +55,9 @@ async def main():
     """The new async boot sequence for Webhooks."""
     print("Initializing Database...")
     await init_db()
+    await ranking.rebuild()
+    await verification_service.restore_verifications()
+    await cleaner.restore_deletions()
     print("Database Initialized!")
 
     if not config.TOKEN:
@@ -59,11 +65,24 @@ async def main():
         exit(1)
 
     req = HTTPXRequest(connection_pool_size=32, read_timeout=60, connect_timeout=60)
-    application = ApplicationBuilder().token(config.TOKEN).request(req).build()
+    # Every Bot API call goes through one queue that respects Telegram's rate limits
+    # Different users are handled in parallel, each user's own updates stay in order
+    application = (
+        ApplicationBuilder()
+        .token(config.TOKEN)
+        .request(req)
+        .rate_limiter(OutboundRateLimiter())
+        .concurrent_updates(UserOrderedUpdateProcessor(config.MAX_CONCURRENT_UPDATES, config.WEBHOOK_QUEUE_SIZE))
+        .build()
+    )
 
     # Setup Scheduled Jobs
-    application.job_queue.run_repeating(cleanup_cache, interval=120, first=120)
+    application.job_queue.run_repeating(advance_expiry_wheel, interval=5, first=5)
+    application.job_queue.run_repeating(verification_handler.expire_verifications, interval=5, first=5)
     application.job_queue.run_daily(economy_service.reset_daily_msg_counts, time=time(hour=16, minute=0))
+    application.job_queue.run_repeating(economy_service.refresh_system_config, interval=config.CONFIG_POLL_SECONDS, first=config.CONFIG_POLL_SECONDS)
+    stats_interval = config.STATS_FLUSH_INTERVAL_MS / 1000
+    application.job_queue.run_repeating(economy_service.flush_stats, interval=stats_interval, first=stats_interval)
 
     # Register Handlers
     application.add_handler(MessageHandler(filters.ALL, priority_spam_check), group=-1)
@@ -74,24 +93,42 @@ async def main():
     # This block safely initializes, starts, and eventually stops the bot
     async with application:
         await application.start()
+        verification_service.start_captcha_pool()
+        cleaner.start_deletion_loop(application.bot)
+        outbox.start_outbox_dispatcher(application.bot)
         
         # 1. Tell Telegram where to push new messages
         # IMPORTANT: Replace the URL below with your ACTUAL Railway URL
         BASE_URL = "https://ruanbot-production.up.railway.app"
-        webhook_url = f"{BASE_URL}/webhook_{config.TOKEN}"
+        webhook_url = f"{BASE_URL}/webhook"
         
-        await application.bot.set_webhook(url=webhook_url, allowed_updates=Update.ALL_TYPES)
-        print(f"🔗 Webhook securely set to: {BASE_URL}/webhook_***")
+        # Telegram sends secret_token back in a header on every call, which the server checks
+        # Only subscribe to the update types our handlers actually use
+        subscribed_updates = allowed_updates(application)
+        await application.bot.set_webhook(url=webhook_url, allowed_updates=subscribed_updates, secret_token=config.WEBHOOK_SECRET)
+        print(f"🔗 Webhook securely set to: {webhook_url} ({', '.join(subscribed_updates)})")
 
         # 2. Start our aiohttp web server to listen for those messages
-        await start_web_server(application)
+        await start_web_server(application, subscribed_updates)
         
         print("🟢 Bot is running in Webhook mode! CPU usage will now rest at 0%.")
         
-        # 3. Keep the program running forever
+        # 3. Keep the program running until Railway (or Ctrl+C) asks us to stop
         stop_signal = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop_signal.set)
         await stop_signal.wait()
 
+        # 4. Graceful shutdown: stop taking updates, then persist everything still buffered
+        print("🛑 Shutting down...")
+        await stop_web_server()
+        await application.stop()
+        await outbox.stop_outbox_dispatcher()
+        await verification_service.stop_captcha_pool()
+        await cleaner.stop_deletion_loop()
+        await economy_service.flush_stats()
+
 if __name__ == '__main__':
     # Run the async main loop
     asyncio.run(main())
\ No newline at end of file
@@ -0,0 +1,12 @@
+from sqlalchemy import Column, Integer, BigInteger, DateTime
+from .base import Base
+
+class ScheduledDeletion(Base):
+    """A message the bot will auto-delete. Kept in the DB so a redeploy doesn't leave them in the chat."""
+    __tablename__ = 'scheduled_deletions'
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    chat_id = Column(BigInteger, nullable=False)
+    message_id = Column(BigInteger, nullable=False)
+    # The cleaner drains everything up to "now" at once, so this is indexed
+    due_at = Column(DateTime, nullable=False, index=True)
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, BigInteger, DateTime
+from sqlalchemy import Column, String, BigInteger, DateTime, Index
 from datetime import datetime
 from .base import Base
 
@@ -9,4 +9,9 @@ class InviteLink(Base):
     link = Column(String, primary_key=True) 
     creator_id = Column(BigInteger, nullable=False)
     chat_id = Column(BigInteger, nullable=False)
-    created_at = Column(DateTime, default=datetime.utcnow)
\ No newline at end of file
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        # "Does this user already have a link for this group?"
+        Index('ix_invite_links_creator_chat', 'creator_id', 'chat_id'),
+    )
\ No newline at end of file
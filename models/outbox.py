@@ -0,0 +1,18 @@
+from sqlalchemy import Column, Integer, BigInteger, String, Text, DateTime
+from datetime import datetime
+from .base import Base
+
+class OutboxMessage(Base):
+    """
+    A message to send once the transaction that created it has committed.
+    Written in the same transaction as the purchase/draw, delivered by services.outbox.
+    """
+    __tablename__ = 'outbox_messages'
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    chat_id = Column(BigInteger, nullable=False)
+    text = Column(Text, nullable=False)
+    parse_mode = Column(String, nullable=True)
+    attempts = Column(Integer, default=0)
+    claimed_until = Column(DateTime, nullable=True)  # Lease held by the dispatcher sending it (also used as retry-after)
+    created_at = Column(DateTime, default=datetime.utcnow)
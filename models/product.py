@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, Boolean
+from sqlalchemy import Column, Integer, String, Float, Boolean, Index
 from .base import Base
 
 class Product(Base):
@@ -9,4 +9,9 @@ class Product(Base):
     cost = Column(Float, nullable=False)
     chance = Column(Float, default=1.0)
     stock = Column(Integer, default=1)
-    is_active = Column(Boolean, default=True)
\ No newline at end of file
+    is_active = Column(Boolean, default=True)
+
+    __table_args__ = (
+        # Shop / scratcher / lottery menus: type=? AND is_active AND stock > 0
+        Index('ix_products_type_active_stock', 'type', 'is_active', 'stock'),
+    )
\ No newline at end of file
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, BigInteger, Integer, DateTime, Boolean
+from sqlalchemy import Column, BigInteger, Integer, DateTime, Boolean, Index
 from datetime import datetime
 from .base import Base
 
@@ -8,4 +8,11 @@ class Referral(Base):
     inviter_id = Column(BigInteger, nullable=False)
     invited_user_id = Column(BigInteger, nullable=False)
     date = Column(DateTime, default=datetime.utcnow)
-    is_rewarded = Column(Boolean, default=False)
\ No newline at end of file
+    is_rewarded = Column(Boolean, default=False)
+
+    __table_args__ = (
+        # Reward check when the invited user hits the message milestone
+        Index('ix_referrals_invited_rewarded', 'invited_user_id', 'is_rewarded'),
+        # Duplicate check when a join / verification is recorded
+        Index('ix_referrals_inviter_invited', 'inviter_id', 'invited_user_id'),
+    )
\ No newline at end of file
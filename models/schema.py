@@ -0,0 +1,8 @@
+from sqlalchemy import Column, Integer
+from .base import Base
+
+class SchemaVersion(Base):
+    """Single row recording which migrations in database.MIGRATIONS have been applied."""
+    __tablename__ = 'schema_version'
+    id = Column(Integer, primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
\ No newline at end of file
@@ -22,4 +22,6 @@ class SystemConfig(Base):
     spam_threshold = Column(Float, default=3.0)
     spam_limit = Column(Integer, default=4)
     media_delete_time = Column(Integer, default=60)
-    admin_media_exempt = Column(Boolean, default=True)
\ No newline at end of file
+    admin_media_exempt = Column(Boolean, default=True)
+    # Bumped on every change so other processes know to reload their cache
+    version = Column(Integer, default=0)
\ No newline at end of file
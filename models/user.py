@@ -9,7 +9,7 @@ class User(Base):
     full_name = Column(String)
     
     # Economy
-    points = Column(Float, default=0.0)
+    points = Column(Float, default=0.0, index=True)  # Indexed: leaderboard sort
     vouchers = Column(Integer, default=0) 
     
     # Check-In Stats
@@ -19,7 +19,7 @@ class User(Base):
     # General Stats
     warnings = Column(Integer, default=0)
     msg_count_total = Column(Integer, default=0)
-    msg_count_daily = Column(Integer, default=0)
+    msg_count_daily = Column(Integer, default=0, index=True)  # Indexed: activity board sort
     last_msg_date = Column(DateTime, default=datetime.utcnow)
     is_verified = Column(Boolean, default=False)
     is_muted = Column(Boolean, default=False)
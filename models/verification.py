@@ -0,0 +1,15 @@
+from sqlalchemy import Column, String, BigInteger, DateTime
+from datetime import datetime
+from .base import Base
+
+class PendingVerification(Base):
+    """A captcha that a new member still has to solve. Survives restarts so nobody stays stuck muted."""
+    __tablename__ = 'pending_verifications'
+
+    user_id = Column(BigInteger, primary_key=True)
+    chat_id = Column(BigInteger, nullable=False)
+    message_id = Column(BigInteger, nullable=True)  # The captcha message, deleted on kick
+    correct = Column(String, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    # The expiry sweep reads "earliest first", so this is indexed
+    expires_at = Column(DateTime, nullable=False, index=True)
@@ -1,20 +1,139 @@
 # ruanbot/services/cleaner.py
+import time
+import heapq
+import asyncio
+from datetime import datetime, timezone
+from sqlalchemy import select, insert, delete
 from telegram import Update
 from telegram.ext import ContextTypes
 from services import economy
+from database import AsyncSessionLocal, ScheduledDeletion
 from utils.admin_cache import is_user_admin
+from utils import metrics
 
-async def delete_message_job(context: ContextTypes.DEFAULT_TYPE):
-    """The job that runs after X seconds to delete the message."""
-    job = context.job
-    chat_id = job.data['chat_id']
-    message_id = job.data['message_id']
-    
-    try:
-        await context.bot.delete_message(chat_id=chat_id, message_id=message_id)
-    except Exception as e:
-        # Message might already be deleted or bot lacks permissions
-        pass
+# --- DELETION SCHEDULER ---
+# Every auto-delete goes into a one-second bucket. A single loop empties the due buckets
+# with deleteMessages (up to 100 IDs per call) instead of one job + one API call per message.
+# The buckets are mirrored in the scheduled_deletions table and reloaded on startup.
+DELETE_BATCH_LIMIT = 100
+SAVE_INTERVAL = 1.0   # New deletions are written to the DB in one batch at most this often
+
+# Format: {due_second: {chat_id: [message_ids]}}
+_deletion_buckets = {}
+_bucket_heap = []   # due_second values, earliest first
+_unsaved = []       # (chat_id, message_id, due_second) not yet in the DB
+_deletion_task = None
+_deletion_wakeup = None
+
+def schedule_deletion(chat_id: int, message_id: int, delay: float):
+    """Deletes the message after `delay` seconds (rounded up to the next whole second)."""
+    due = int(time.time() + delay) + 1
+    _add_to_bucket(chat_id, message_id, due)
+    _unsaved.append((chat_id, message_id, due))
+
+def _add_to_bucket(chat_id: int, message_id: int, due: int):
+    bucket = _deletion_buckets.get(due)
+    if bucket is None:
+        bucket = _deletion_buckets[due] = {}
+        heapq.heappush(_bucket_heap, due)
+        # New earliest deadline: wake the loop so it sleeps for the right amount
+        if _deletion_wakeup and _bucket_heap[0] == due:
+            _deletion_wakeup.set()
+    bucket.setdefault(chat_id, []).append(message_id)
+
+async def restore_deletions():
+    """Startup: reloads pending deletions. Ones that fell due while we were down go out in the first sweep."""
+    async with AsyncSessionLocal() as session:
+        result = await session.execute(
+            select(ScheduledDeletion.chat_id, ScheduledDeletion.message_id, ScheduledDeletion.due_at)
+        )
+        rows = result.all()
+
+    for chat_id, message_id, due_at in rows:
+        _add_to_bucket(chat_id, message_id, int(due_at.replace(tzinfo=timezone.utc).timestamp()))
+    if rows:
+        print(f"🧹 Restored {len(rows)} scheduled deletions")
+
+def start_deletion_loop(bot):
+    global _deletion_task, _deletion_wakeup
+    _deletion_wakeup = asyncio.Event()
+    _deletion_task = asyncio.get_running_loop().create_task(_deletion_loop(bot))
+
+async def stop_deletion_loop():
+    global _deletion_task
+    if _deletion_task:
+        _deletion_task.cancel()
+        _deletion_task = None
+    await _save_unsaved()
+
+async def _save_unsaved():
+    global _unsaved
+    if not _unsaved:
+        return
+    batch, _unsaved = _unsaved, []
+    async with AsyncSessionLocal() as session:
+        try:
+            await session.execute(insert(ScheduledDeletion), [
+                {'chat_id': chat_id, 'message_id': message_id, 'due_at': datetime.utcfromtimestamp(due)}
+                for chat_id, message_id, due in batch
+            ])
+            await session.commit()
+        except Exception as e:
+            print(f"❌ Error saving scheduled deletions: {e}")
+            _unsaved = batch + _unsaved # Retry on the next pass
+
+async def _forget_done(up_to: int):
+    """Drops the DB rows for every bucket that has been processed."""
+    async with AsyncSessionLocal() as session:
+        try:
+            await session.execute(
+                delete(ScheduledDeletion).where(ScheduledDeletion.due_at <= datetime.utcfromtimestamp(up_to))
+            )
+            await session.commit()
+        except Exception as e:
+            # Harmless: they get deleted again (a no-op) after the next restart
+            print(f"⚠️ Error clearing scheduled deletions: {e}")
+
+async def _deletion_loop(bot):
+    while True:
+        _deletion_wakeup.clear()
+        await _save_unsaved()
+
+        wait = _bucket_heap[0] - time.time() if _bucket_heap else None
+        if wait is None or wait > 0:
+            # Tick at least every SAVE_INTERVAL so new deletions reach the DB in batches
+            wait = SAVE_INTERVAL if wait is None else min(wait, SAVE_INTERVAL)
+            try:
+                await asyncio.wait_for(_deletion_wakeup.wait(), timeout=wait)
+            except asyncio.TimeoutError:
+                pass
+            continue
+
+        # Merge every due bucket so each chat gets as few calls as possible
+        now = time.time()
+        due_by_chat = {}
+        last_due = None
+        while _bucket_heap and _bucket_heap[0] <= now:
+            last_due = heapq.heappop(_bucket_heap)
+            for chat_id, message_ids in _deletion_buckets.pop(last_due).items():
+                due_by_chat.setdefault(chat_id, []).extend(message_ids)
+
+        await asyncio.gather(*(
+            _delete_in_chat(bot, chat_id, message_ids)
+            for chat_id, message_ids in due_by_chat.items()
+        ))
+        await _forget_done(last_due)
+
+async def _delete_in_chat(bot, chat_id: int, message_ids: list):
+    for i in range(0, len(message_ids), DELETE_BATCH_LIMIT):
+        batch = message_ids[i:i + DELETE_BATCH_LIMIT]
+        metrics.inc('delete_api_calls_total')
+        try:
+            await bot.delete_messages(chat_id=chat_id, message_ids=batch)
+            metrics.inc('messages_deleted_total', len(batch))
+        except Exception as e:
+            # Messages might already be deleted or bot lacks permissions
+            metrics.inc('delete_failures_total')
 
 async def schedule_media_deletion(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Checks config and schedules deletion if enabled."""
@@ -52,9 +171,4 @@ async def schedule_media_deletion(update: Update, context: ContextTypes.DEFAULT_
                 return # Skip deletion for admins!
         # --------------------------------------------------------
 
-        context.job_queue.run_once(
-            delete_message_job,
-            when=delay,
-            data={'chat_id': msg.chat_id, 'message_id': msg.message_id},
-            name=f"del_{msg.chat_id}_{msg.message_id}"
-        )
\ No newline at end of file
+        schedule_deletion(msg.chat_id, msg.message_id, delay)
\ No newline at end of file
@@ -1,69 +1,207 @@
 # services/economy.py
-from database import AsyncSessionLocal
+import asyncio
+import config
+from database import AsyncSessionLocal, insert_ignore
 from models.user import User
 from models.settings import SystemConfig
-from sqlalchemy import update, desc, select, func
+from sqlalchemy import update, select, func, bindparam, case
 from datetime import datetime
+from utils.lru import LRUCache
+from services import ranking
 
 # --- CACHE ---
+# The config row carries a version number that every admin change bumps.
+# refresh_system_config() polls just that number, so replicas pick up changes
+# within config.CONFIG_POLL_SECONDS while reads stay in memory.
 _config_cache = None
+_config_version = None
 
-_known_users = set()
+# --- WRITE-BEHIND MESSAGE STATS ---
+# Message counters are buffered here and written in bulk by flush_stats().
+# Format: {user_id: {'count': int, 'last_msg_date': datetime, 'on_milestone': async callable or None}}
+_pending_stats = {}
+_pending_messages = 0
+_flush_lock = asyncio.Lock()
+_flush_tasks = set()
+
+# Total message count at which an invited user's referral gets rewarded
+INVITE_MESSAGE_MILESTONE = 50
+
+# Users we know already exist in the DB
+_known_users = LRUCache(maxsize=config.KNOWN_USERS_CACHE_SIZE)
+
+# New users seen within the same short window are inserted together.
+# Format: {user_id: {'id': ..., 'username': ..., 'full_name': ...}}
+_pending_new_users = {}
+_registration_batch = None  # Future shared by every caller waiting on the current batch
+_registration_tasks = set()
+USER_BATCH_WINDOW = 0.02    # seconds
 
 async def get_or_create_user(user_id: int, username: str, full_name: str):
     # Check our fast memory first
-    if user_id in _known_users:
+    if _known_users.get(user_id):
         return
-        
-    # Optional Safety Check: If memory gets too big, clear it
-    if len(_known_users) > 10000:
-        _known_users.clear()
-        
-    async with AsyncSessionLocal() as session:
-        try:
-            result = await session.execute(select(User).filter_by(id=user_id))
-            user = result.scalars().first()
-            if not user:
-                user = User(id=user_id, username=username, full_name=full_name)
-                session.add(user)
+
+    global _registration_batch
+    _pending_new_users[user_id] = {'id': user_id, 'username': username, 'full_name': full_name}
+
+    batch = _registration_batch
+    if batch is None:
+        # First miss of this window starts the batch; everyone else just joins it
+        loop = asyncio.get_running_loop()
+        batch = _registration_batch = loop.create_future()
+        task = loop.create_task(_register_pending_users(batch))
+        _registration_tasks.add(task)
+        task.add_done_callback(_registration_tasks.discard)
+        # Also covers the task being cancelled before it even started running
+        task.add_done_callback(lambda _: _finish_batch(batch))
+
+    await asyncio.shield(batch)
+
+async def _register_pending_users(batch):
+    """Inserts every user that missed the cache during the window in one upsert."""
+    global _registration_batch
+    try:
+        await asyncio.sleep(USER_BATCH_WINDOW)
+
+        rows = list(_pending_new_users.values())
+        _pending_new_users.clear()
+        _registration_batch = None
+
+        async with AsyncSessionLocal() as session:
+            try:
+                stmt = insert_ignore(User).values(rows).returning(User.id)
+                result = await session.execute(stmt)
+                created = set(result.scalars().all())
                 await session.commit()
-                print(f"🆕 New user created: {full_name} ({user_id})")
-            
-            # Remember them!
-            _known_users.add(user_id) 
-            
-        except Exception as e:
-            await session.rollback()
-            print(f"❌ DB Error get_or_create: {e}")
+
+                # Remember them! (Whether we just created them or they already existed)
+                for row in rows:
+                    _known_users.put(row['id'])
+                    if row['id'] in created:
+                        ranking.record(row['id'], row['full_name'], points=0.0, msg_count_daily=0)
+                        print(f"🆕 New user created: {row['full_name']} ({row['id']})")
+            except Exception as e:
+                await session.rollback()
+                print(f"❌ DB Error get_or_create: {e}")
+    finally:
+        _finish_batch(batch)
+
+def _finish_batch(batch):
+    """Cancelled (e.g. shutdown) or not, nobody may be left waiting on a batch."""
+    global _registration_batch
+    if _registration_batch is batch:
+        _registration_batch = None
+    if not batch.done():
+        batch.set_result(None)
 
 async def add_points(user_id: int, amount: float):
     async with AsyncSessionLocal() as session:
         try:
-            stmt = update(User).where(User.id == user_id).values(points=User.points + amount)
-            await session.execute(stmt)
+            stmt = update(User).where(User.id == user_id).values(points=User.points + amount).returning(User.points, User.full_name)
+            result = await session.execute(stmt)
+            row = result.first()
             await session.commit()
+            if row:
+                ranking.record(user_id, row.full_name, points=row.points)
             print(f"💰 Points Added! User: {user_id}, Amount: +{amount}")
         except Exception as e:
             await session.rollback()
             print(f"❌ DB Error adding points: {e}")
 
-async def increment_stats(user_id: int):
-    async with AsyncSessionLocal() as session:
-        try:
-            stmt = update(User).where(User.id == user_id).values(
-                msg_count_total=User.msg_count_total + 1,
-                msg_count_daily=User.msg_count_daily + 1,
-                last_msg_date=datetime.utcnow()
-            ).returning(User.msg_count_total)
-            
-            result = await session.execute(stmt)
-            new_total = result.scalar()
-            await session.commit()
-            return new_total or 0
-        except Exception as e:
-            print(f"❌ DB Error stats: {e}")
-            await session.rollback()
-            return 0
+def increment_stats(user_id: int, on_milestone=None):
+    """
+    Buffers one message for this user. The counters reach the DB on the next flush.
+    `on_milestone` is awaited after the flush that pushes the user's total past INVITE_MESSAGE_MILESTONE.
+    """
+    global _pending_messages
+    entry = _pending_stats.get(user_id)
+    if entry is None:
+        entry = {'count': 0, 'last_msg_date': None, 'on_milestone': None}
+        _pending_stats[user_id] = entry
+
+    entry['count'] += 1
+    entry['last_msg_date'] = datetime.utcnow()
+    if on_milestone:
+        entry['on_milestone'] = on_milestone
+
+    _pending_messages += 1
+    if _pending_messages >= config.STATS_FLUSH_MAX_PENDING and not _flush_tasks:
+        # Buffer is full: flush now instead of waiting for the next tick
+        task = asyncio.get_running_loop().create_task(flush_stats())
+        _flush_tasks.add(task)
+        task.add_done_callback(_flush_tasks.discard)
+
+def _crossed_milestone(new_total: int, added: int) -> bool:
+    return new_total - added < INVITE_MESSAGE_MILESTONE <= new_total
+
+def _requeue_stats(batch: dict):
+    """Puts a batch back into the buffer after a failed flush so no messages are lost."""
+    global _pending_messages
+    for user_id, old in batch.items():
+        entry = _pending_stats.get(user_id)
+        if entry is None:
+            _pending_stats[user_id] = old
+        else:
+            entry['count'] += old['count']
+            entry['on_milestone'] = entry['on_milestone'] or old['on_milestone']
+        _pending_messages += old['count']
+
+async def flush_stats(context=None):
+    """
+    Writes all buffered message counters in one bulk UPDATE.
+    Runs on a timer, when the buffer fills up, and on shutdown.
+    """
+    global _pending_messages
+    async with _flush_lock:
+        if not _pending_stats:
+            return
+
+        # Swap the buffer out before the first await so new messages go into a fresh one
+        batch = dict(_pending_stats)
+        _pending_stats.clear()
+        _pending_messages = 0
+
+        users = User.__table__
+        stmt = update(users).where(users.c.id == bindparam('b_id')).values(
+            msg_count_total=users.c.msg_count_total + bindparam('b_count'),
+            msg_count_daily=users.c.msg_count_daily + bindparam('b_count'),
+            last_msg_date=bindparam('b_date')
+        )
+        params = [
+            {'b_id': user_id, 'b_count': entry['count'], 'b_date': entry['last_msg_date']}
+            for user_id, entry in batch.items()
+        ]
+
+        async with AsyncSessionLocal() as session:
+            try:
+                await session.execute(stmt, params)
+                # Rows stay locked until commit, so these totals include exactly our increments
+                result = await session.execute(
+                    select(User.id, User.msg_count_total, User.msg_count_daily, User.full_name)
+                    .where(User.id.in_(list(batch)))
+                )
+                rows = result.all()
+                await session.commit()
+            except Exception as e:
+                await session.rollback()
+                print(f"❌ DB Error flushing stats: {e}")
+                _requeue_stats(batch)
+                return
+
+    totals = {}
+    for row in rows:
+        totals[row.id] = row.msg_count_total
+        ranking.record(row.id, row.full_name, msg_count_daily=row.msg_count_daily)
+
+    # Milestone callbacks run outside the lock so they can't stall the next flush
+    for user_id, entry in batch.items():
+        callback = entry['on_milestone']
+        if callback and _crossed_milestone(totals.get(user_id) or 0, entry['count']):
+            try:
+                await callback()
+            except Exception as e:
+                print(f"❌ Milestone callback failed for {user_id}: {e}")
 
 async def get_user_balance(user_id: int) -> float:
     async with AsyncSessionLocal() as session:
@@ -94,6 +232,8 @@ async def add_vouchers(user_id: int, amount: int):
             await session.rollback()
 
 async def reset_daily_msg_counts(context=None):
+    # Buffered messages belong to the day that is ending
+    await flush_stats()
     async with AsyncSessionLocal() as session:
         try:
             # We now reset both daily messages AND daily points
@@ -101,65 +241,63 @@ async def reset_daily_msg_counts(context=None):
             await session.execute(stmt)
             await session.commit()
             print("🔄 Daily message counts and daily points have been reset.")
+            await ranking.rebuild()
         except Exception as e:
             print(f"❌ Error resetting daily counts: {e}")
             await session.rollback()
 
-async def award_chat_points(user_id: int, amount: float, max_daily_points: int) -> bool:
-    """Awards points securely, checking against the daily limit."""
+async def record_message_with_points(user_id: int, amount: float, max_daily_points: int, on_milestone=None) -> int:
+    """
+    Counts a message AND awards chat points in a single conditional UPDATE.
+    Any counters still buffered for this user are applied in the same statement.
+    Points are only added while points_earned_daily + amount <= max_daily_points.
+    Returns the new total message count (0 on failure).
+    """
+    global _pending_messages
+    entry = _pending_stats.pop(user_id, None)
+    count = 1
+    if entry:
+        count += entry['count']
+        _pending_messages -= entry['count']
+        on_milestone = on_milestone or entry['on_milestone']
+
+    now = datetime.utcnow()
+    # The cap is evaluated against the row as the UPDATE sees it, so rapid messages can't bypass it
+    within_cap = User.points_earned_daily + amount <= max_daily_points
+    stmt = update(User).where(User.id == user_id).values(
+        msg_count_total=User.msg_count_total + count,
+        msg_count_daily=User.msg_count_daily + count,
+        last_msg_date=now,
+        points=case((within_cap, User.points + amount), else_=User.points),
+        points_earned_daily=case((within_cap, User.points_earned_daily + amount), else_=User.points_earned_daily)
+    ).returning(User.msg_count_total, User.msg_count_daily, User.points, User.full_name)
+
     async with AsyncSessionLocal() as session:
         try:
-            # .with_for_update() locks the row so rapid messages don't bypass the limit
-            result = await session.execute(select(User).filter_by(id=user_id).with_for_update())
-            user = result.scalars().first()
-            
-            if not user:
-                return False
-
-            # Check if adding these points exceeds the limit
-            if user.points_earned_daily + amount <= max_daily_points:
-                user.points += amount
-                user.points_earned_daily += amount
-                await session.commit()
-                print(f"💰 Chat Points Added! User: {user_id}, Amount: +{amount} (Daily: {user.points_earned_daily}/{max_daily_points})")
-                return True
-            else:
-                # Limit reached, roll back the lock
-                await session.rollback()
-                return False
-                
+            result = await session.execute(stmt)
+            row = result.first()
+            await session.commit()
         except Exception as e:
             await session.rollback()
-            print(f"❌ DB Error awarding chat points: {e}")
-            return False
+            print(f"❌ DB Error recording message: {e}")
+            # Buffered messages and this one go back for the next flush (points are not retried)
+            _requeue_stats({user_id: {'count': count, 'last_msg_date': now, 'on_milestone': on_milestone}})
+            return 0
 
-async def get_leaderboard(sort_by='points', limit=10, offset=0):
-    async with AsyncSessionLocal() as session:
-        if sort_by in ['daily_msg', 'msg']:
-            stmt = select(User).order_by(desc(User.msg_count_daily)).limit(limit).offset(offset)
-        else:
-            stmt = select(User).order_by(desc(User.points)).limit(limit).offset(offset)
-        
-        result = await session.execute(stmt)
-        users = result.scalars().all()
-        
-        results = []
-        for u in users:
-            results.append({
-                'full_name': u.full_name,
-                'points': u.points,
-                'msg_count_daily': u.msg_count_daily
-            })
-        return results
-
-async def get_total_ranked_users(max_limit=30):
-    async with AsyncSessionLocal() as session:
-        result = await session.execute(select(func.count(User.id)))
-        count = result.scalar() or 0
-        return min(count, max_limit)
+    if not row:
+        # User row not there (yet): keep the counts for the next flush instead of dropping them
+        print(f"⚠️ No user row for {user_id} while recording a message, counts requeued")
+        _requeue_stats({user_id: {'count': count, 'last_msg_date': now, 'on_milestone': on_milestone}})
+        return 0
+    new_total = row.msg_count_total
+    ranking.record(user_id, row.full_name, points=row.points, msg_count_daily=row.msg_count_daily)
+
+    if on_milestone and _crossed_milestone(new_total, count):
+        await on_milestone()
+    return new_total
 
 async def get_system_config():
-    global _config_cache
+    global _config_cache, _config_version
     if _config_cache:
         return _config_cache
 
@@ -185,6 +323,7 @@ async def get_system_config():
                 'media_delete_time': config.media_delete_time,
                 'admin_media_exempt': config.admin_media_exempt
             }
+            _config_version = config.version
             return _config_cache
         except Exception as e:
             print(f"❌ Error fetching config: {e}")
@@ -196,13 +335,17 @@ async def update_system_config(**kwargs):
         try:
             result = await session.execute(select(SystemConfig).filter_by(id=1))
             config = result.scalars().first()
-            if not config:
-                config = SystemConfig(id=1)
+            is_new = config is None
+            if is_new:
+                config = SystemConfig(id=1, version=1)
                 session.add(config)
             
             for key, value in kwargs.items():
                 if hasattr(config, key):
                     setattr(config, key, value)
+            if not is_new:
+                # Tell the other replicas (atomic, in case two admins save at once)
+                config.version = func.coalesce(SystemConfig.version, 0) + 1
             
             await session.commit()
             _config_cache = None 
@@ -212,6 +355,27 @@ async def update_system_config(**kwargs):
             await session.rollback()
             return False
 
+async def refresh_system_config(context=None):
+    """
+    Job: drops the cached config if another process changed it.
+    Costs one tiny primary-key lookup per poll, never a query per read.
+    """
+    global _config_cache
+    if _config_cache is None:
+        return # Nothing cached, the next read loads fresh values anyway
+
+    async with AsyncSessionLocal() as session:
+        try:
+            result = await session.execute(select(SystemConfig.version).filter_by(id=1))
+            version = result.scalar()
+        except Exception as e:
+            print(f"❌ Error polling config version: {e}")
+            return
+
+    if version != _config_version:
+        _config_cache = None
+        print(f"🔄 System config changed (version {version}), reloading.")
+
 async def get_voucher_cost() -> int:
     conf = await get_system_config()
     return conf.get('voucher_cost', 500)
@@ -257,6 +421,7 @@ async def process_check_in(user_id: int, username: str, full_name: str):
             user.last_check_in_date = now
             
             await session.commit()
+            ranking.record(user.id, user.full_name, points=user.points)
             return True, "✅ 签到成功!", points_to_add
             
         except Exception as e:
@@ -274,6 +439,7 @@ async def remove_points(user_id: int, amount: float):
                 # Ensure points never drop below 0
                 user.points = max(0.0, user.points - amount)
                 await session.commit()
+                ranking.record(user.id, user.full_name, points=user.points)
                 print(f"💸 Points Removed! User: {user_id}, Amount: -{amount}")
                 return True
         except Exception as e:
@@ -306,6 +472,7 @@ async def reset_all_points() -> bool:
             await session.execute(stmt)
             await session.commit()
             print("⚠️ MONTHLY WIPE: All user points have been reset to 0.")
+            await ranking.rebuild()
             return True
         except Exception as e:
             print(f"❌ Error resetting all points: {e}")
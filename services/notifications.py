@@ -0,0 +1,47 @@
+# services/notifications.py
+import asyncio
+from utils.rate_limiter import NOTIFICATION
+import config
+
+# Telegram rejects messages longer than this
+MAX_MESSAGE_LENGTH = 4096
+
+# Shared by every admin being notified, so a burst of notices never has more than this many sends going
+_send_slots = asyncio.Semaphore(config.ADMIN_NOTIFY_CONCURRENCY)
+
+async def send_admin_digest(bot, admin_id: int, texts: list) -> int:
+    """
+    Sends one admin their waiting HTML notices (the outbox collects them, waiting
+    ADMIN_DIGEST_SECONDS so close ones arrive together), merged into as few messages as fit.
+    Returns how many of `texts`, from the start, were delivered before a send failed.
+    """
+    delivered = 0
+    for text, count in _build_digest(texts):
+        async with _send_slots:
+            try:
+                await bot.send_message(chat_id=admin_id, text=text, parse_mode='HTML', rate_limit_args=NOTIFICATION)
+            except Exception as e:
+                print(f"Could not notify admin {admin_id}: {e}")
+                break
+        delivered += count
+    return delivered
+
+def _build_digest(batch: list) -> list:
+    """
+    One message per notification if there's just one, otherwise as few combined messages as fit.
+    Returns [(message_text, notifications_in_it)].
+    """
+    if len(batch) == 1:
+        return [(batch[0], 1)]
+    header = f"📬 {len(batch)} 条新通知\n\n"
+    messages = []
+    current, count = header, 0
+    for text in batch:
+        entry = text + "\n\n"
+        if len(current) + len(entry) > MAX_MESSAGE_LENGTH and current != header:
+            messages.append((current.rstrip(), count))
+            current, count = "", 0
+        current += entry
+        count += 1
+    messages.append((current.rstrip(), count))
+    return messages
@@ -0,0 +1,173 @@
+# services/outbox.py
+import asyncio
+from datetime import datetime, timedelta
+from sqlalchemy import select, delete, update, or_, and_
+from database import AsyncSessionLocal, OutboxMessage
+from services import notifications
+import config
+
+# Claimed rows held in memory at once, how often leftovers (e.g. from before a restart) are
+# picked up, and how long a claim lasts before another dispatcher may take the row over
+OUTBOX_BATCH_SIZE = 50
+OUTBOX_POLL_SECONDS = 5
+OUTBOX_LEASE_SECONDS = 300
+MAX_ATTEMPTS = 5
+
+_dispatch_task = None
+_dispatch_wakeup = None
+# One sender task per chat, so a throttled chat (e.g. a group at its 20/min limit) only delays itself
+# Format: {chat_id: [row, ...]} and {chat_id: asyncio.Task}
+_chat_queues = {}
+_chat_senders = {}
+_in_flight = 0 # Claimed rows whose result isn't recorded yet
+
+def enqueue(session, chat_id: int, text: str, parse_mode: str = 'HTML'):
+    """Adds a group/user message to the caller's transaction. Sent only if that transaction commits."""
+    session.add(OutboxMessage(chat_id=chat_id, text=text, parse_mode=parse_mode))
+
+def enqueue_admin_notice(session, text: str):
+    """Same as enqueue, for a notification to every admin (one row each, so each is retried on its own)."""
+    for admin_id in config.ADMIN_IDS:
+        session.add(OutboxMessage(chat_id=admin_id, text=text, parse_mode='HTML'))
+
+def wake():
+    """Call after committing something that enqueued messages, so they go out right away."""
+    if _dispatch_wakeup:
+        _dispatch_wakeup.set()
+
+def start_outbox_dispatcher(bot):
+    global _dispatch_task, _dispatch_wakeup
+    _dispatch_wakeup = asyncio.Event()
+    _dispatch_task = asyncio.get_running_loop().create_task(_dispatch_loop(bot))
+
+async def stop_outbox_dispatcher():
+    global _dispatch_task
+    if _dispatch_task:
+        _dispatch_task.cancel()
+        _dispatch_task = None
+    for sender in list(_chat_senders.values()):
+        sender.cancel()
+
+    # Hand back what we claimed but never sent, so the next start doesn't wait out the lease
+    unsent = [row.id for queue in _chat_queues.values() for row in queue]
+    if unsent:
+        async with AsyncSessionLocal() as session:
+            try:
+                await session.execute(update(OutboxMessage).where(OutboxMessage.id.in_(unsent)).values(claimed_until=None))
+                await session.commit()
+            except Exception as e:
+                print(f"❌ Error releasing outbox messages: {e}")
+
+async def _dispatch_loop(bot):
+    while True:
+        _dispatch_wakeup.clear()
+        room = OUTBOX_BATCH_SIZE - _in_flight
+        if room > 0:
+            try:
+                await _claim_batch(bot, room)
+            except Exception as e:
+                print(f"❌ Outbox dispatch failed: {e}")
+        # Senders wake us as soon as they free up room for more
+        try:
+            await asyncio.wait_for(_dispatch_wakeup.wait(), timeout=OUTBOX_POLL_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+
+def _due_filter(now: datetime):
+    """Admin notices wait until the oldest one is ADMIN_DIGEST_SECONDS old, so close ones share a digest."""
+    unclaimed = or_(OutboxMessage.claimed_until.is_(None), OutboxMessage.claimed_until <= now)
+    if config.ADMIN_DIGEST_SECONDS <= 0 or not config.ADMIN_IDS:
+        return unclaimed
+    cutoff = now - timedelta(seconds=config.ADMIN_DIGEST_SECONDS)
+    ready_admins = (
+        select(OutboxMessage.chat_id)
+        .where(OutboxMessage.chat_id.in_(config.ADMIN_IDS), OutboxMessage.created_at <= cutoff)
+    )
+    return and_(unclaimed, or_(OutboxMessage.chat_id.notin_(config.ADMIN_IDS), OutboxMessage.chat_id.in_(ready_admins)))
+
+async def _claim_batch(bot, limit: int) -> int:
+    """
+    Claims up to `limit` due rows by stamping a lease on them in one short transaction
+    (SKIP LOCKED, so several processes never claim the same row), then hands them to
+    the senders. Delivery is at-least-once: a crash after sending but before the row is
+    deleted sends it again once the lease runs out.
+    """
+    global _in_flight
+    now = datetime.utcnow()
+    async with AsyncSessionLocal() as session:
+        due = (
+            select(OutboxMessage.id)
+            .where(_due_filter(now))
+            .order_by(OutboxMessage.id)
+            .limit(limit)
+            .with_for_update(skip_locked=True)
+        )
+        result = await session.execute(
+            update(OutboxMessage)
+            .where(OutboxMessage.id.in_(due))
+            .values(claimed_until=now + timedelta(seconds=OUTBOX_LEASE_SECONDS))
+            .returning(OutboxMessage.id, OutboxMessage.chat_id, OutboxMessage.text, OutboxMessage.parse_mode, OutboxMessage.attempts)
+        )
+        rows = sorted(result.all(), key=lambda row: row.id)
+        await session.commit()
+
+    _in_flight += len(rows)
+    loop = asyncio.get_running_loop()
+    for row in rows:
+        _chat_queues.setdefault(row.chat_id, []).append(row)
+        if row.chat_id not in _chat_senders:
+            _chat_senders[row.chat_id] = loop.create_task(_send_chat(bot, row.chat_id))
+    return len(rows)
+
+async def _send_chat(bot, chat_id: int):
+    """Sends one chat's claimed rows in order and records each result as soon as it's known."""
+    global _in_flight
+    queue = _chat_queues[chat_id]
+    try:
+        while queue:
+            if chat_id in config.ADMIN_IDS:
+                # Everything waiting for this admin goes out as one digest
+                rows = queue[:]
+                queue.clear()
+                delivered = await notifications.send_admin_digest(bot, chat_id, [row.text for row in rows])
+                results = [(row, None) for row in rows[:delivered]] + [(row, "send failed") for row in rows[delivered:]]
+            else:
+                row = queue.pop(0)
+                try:
+                    await bot.send_message(chat_id=chat_id, text=row.text, parse_mode=row.parse_mode)
+                    results = [(row, None)]
+                except Exception as e:
+                    results = [(row, e)]
+
+            try:
+                await _record_results(results)
+            except Exception as e:
+                # The rows keep their lease and are retried once it runs out
+                print(f"❌ Error recording outbox results: {e}")
+            _in_flight -= len(results)
+            _dispatch_wakeup.set()
+    finally:
+        del _chat_senders[chat_id]
+        if not queue:
+            del _chat_queues[chat_id]
+
+async def _record_results(results: list):
+    """Deletes delivered rows; failed ones count an attempt and are retried after a backoff."""
+    now = datetime.utcnow()
+    done = []
+    async with AsyncSessionLocal() as session:
+        for row, error in results:
+            if error is None:
+                done.append(row.id)
+            elif row.attempts + 1 >= MAX_ATTEMPTS:
+                print(f"❌ Giving up on outbox message {row.id} to {row.chat_id}: {error}")
+                done.append(row.id)
+            else:
+                retry_at = now + timedelta(seconds=OUTBOX_POLL_SECONDS * 2 ** row.attempts)
+                await session.execute(
+                    update(OutboxMessage).where(OutboxMessage.id == row.id)
+                    .values(attempts=OutboxMessage.attempts + 1, claimed_until=retry_at)
+                )
+        if done:
+            await session.execute(delete(OutboxMessage).where(OutboxMessage.id.in_(done)))
+        await session.commit()
\ No newline at end of file
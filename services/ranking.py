@@ -0,0 +1,184 @@
+# services/ranking.py
+import time
+import heapq
+import asyncio
+from sqlalchemy import select, desc
+from database import AsyncSessionLocal
+from models.user import User
+import config
+
+# Users kept per board. The leaderboard shows 30, the extra room absorbs users dropping out.
+BOARD_SIZE = 60
+
+class _Board:
+    """
+    In-memory top BOARD_SIZE users for one column, updated by the code that changes that column.
+
+    Invariant: no user outside the board has a value above `floor`
+    (floor is None while every user in the DB fits on the board).
+
+    The board only sees changes made by this process. With several processes writing
+    to the same DB, set LEADERBOARD_MAX_AGE so each one reloads from the DB that often.
+    """
+    def __init__(self, column: str):
+        self.column = column
+        self.members = {}   # {user_id: [value, full_name]}
+        # Min-heap of (value, -user_id, user_id) for eviction; entries whose value no longer
+        # matches the member are stale and skipped
+        self._heap = []
+        self.floor = None
+        self.loaded_at = 0.0
+        self.dirty = True   # Must be reloaded from the DB before the next read
+        self.version = 0    # Bumped on every visible change (used by the page cache)
+        self._ranked = None
+        self._lock = asyncio.Lock()
+        self._replay = None # Updates that arrive while a reload query is running
+
+    def update(self, user_id: int, value, full_name=None):
+        if self._replay is not None:
+            self._replay.append((user_id, value, full_name))
+        members = self.members
+        member = members.get(user_id)
+
+        if member is not None:
+            if value < member[0] and self.floor is not None and value < self.floor:
+                # Someone outside the board may now rank higher and we don't know who
+                self.dirty = True
+                return
+            if value != member[0]:
+                member[0] = value
+                self._push(user_id, value)
+            if full_name is not None:
+                member[1] = full_name
+        else:
+            if len(members) >= BOARD_SIZE:
+                lowest_value, _, lowest_id = self._lowest()
+                if value <= lowest_value:
+                    self._raise_floor(value)
+                    return
+                heapq.heappop(self._heap)
+                self._raise_floor(members.pop(lowest_id)[0])
+            members[user_id] = [value, full_name]
+            self._push(user_id, value)
+
+        self._ranked = None
+        self.version += 1
+
+    def _push(self, user_id: int, value):
+        heap = self._heap
+        if len(heap) > 4 * BOARD_SIZE:
+            # Mostly stale entries by now: rebuild from the members
+            heap[:] = [(member[0], -uid, uid) for uid, member in self.members.items()]
+            heapq.heapify(heap)
+        else:
+            heapq.heappush(heap, (value, -user_id, user_id))
+
+    def _lowest(self):
+        """The member that gets evicted first (lowest value, then highest id)."""
+        heap = self._heap
+        while True:
+            value, _, user_id = heap[0]
+            member = self.members.get(user_id)
+            if member is not None and member[0] == value:
+                return heap[0]
+            heapq.heappop(heap)
+
+    def _raise_floor(self, value):
+        if self.floor is None or value > self.floor:
+            self.floor = value
+
+    def load(self, rows):
+        """rows: (id, full_name, value) sorted best first, at most BOARD_SIZE + 1 of them."""
+        self.members = {row[0]: [row[2], row[1]] for row in rows[:BOARD_SIZE]}
+        self._heap = [(row[2], -row[0], row[0]) for row in rows[:BOARD_SIZE]]
+        heapq.heapify(self._heap)
+        self.floor = rows[BOARD_SIZE][2] if len(rows) > BOARD_SIZE else None
+        self.dirty = False
+        self.loaded_at = time.monotonic()
+        self._ranked = None
+        self.version += 1
+
+        # Values are absolute, so replaying ones the snapshot already saw is harmless
+        replay, self._replay = self._replay or [], None
+        for user_id, value, full_name in replay:
+            self.update(user_id, value, full_name)
+
+    def ranked(self):
+        if self._ranked is None:
+            self._ranked = sorted(self.members.items(), key=lambda item: (-item[1][0], item[0]))
+        return self._ranked
+
+_boards = {
+    'points': _Board('points'),
+    'msg': _Board('msg_count_daily'),
+}
+
+def _get_board(sort_by: str) -> _Board:
+    return _boards['msg'] if sort_by in ['daily_msg', 'msg'] else _boards['points']
+
+async def _ensure_fresh(board: _Board):
+    if config.LEADERBOARD_MAX_AGE and time.monotonic() - board.loaded_at > config.LEADERBOARD_MAX_AGE:
+        board.dirty = True # Other processes may have changed the DB
+    if not board.dirty:
+        return
+    async with board._lock:
+        if board.dirty:
+            await _load_board(board)
+
+async def _load_board(board: _Board):
+    column = getattr(User, board.column)
+    board._replay = []
+    async with AsyncSessionLocal() as session:
+        try:
+            result = await session.execute(
+                select(User.id, User.full_name, column)
+                .order_by(desc(column), User.id)
+                .limit(BOARD_SIZE + 1)
+            )
+            rows = result.all()
+        except Exception as e:
+            board._replay = None
+            print(f"❌ Error loading leaderboard: {e}")
+            return
+    board.load(rows)
+
+async def rebuild():
+    """Reloads both boards from the DB (startup and after bulk resets)."""
+    for board in _boards.values():
+        async with board._lock:
+            await _load_board(board)
+
+def record(user_id: int, full_name=None, points=None, msg_count_daily=None):
+    """Feeds a user's new values into the boards. Pass only what changed."""
+    if points is not None:
+        _boards['points'].update(user_id, points, full_name)
+    if msg_count_daily is not None:
+        _boards['msg'].update(user_id, msg_count_daily, full_name)
+
+async def get_version(sort_by: str):
+    """
+    Identifies what a rendered page of this board depends on: the board itself,
+    plus the points board (which provides the page count).
+    """
+    board = _get_board(sort_by)
+    await _ensure_fresh(board)
+    await _ensure_fresh(_boards['points'])
+    return (board.version, _boards['points'].version)
+
+async def get_leaderboard(sort_by='points', limit=10, offset=0):
+    """
+    Returns one page of the board without touching the DB.
+    Each entry has 'full_name' and the sorted column ('points' or 'msg_count_daily').
+    """
+    board = _get_board(sort_by)
+    await _ensure_fresh(board)
+    return [
+        {'full_name': name, board.column: value}
+        for _, (value, name) in board.ranked()[offset:offset + limit]
+    ]
+
+async def get_total_ranked_users(max_limit=30):
+    # While the board isn't full it holds every user, so its size is the user count
+    board = _boards['points']
+    await _ensure_fresh(board)
+    return min(len(board.members), max_limit)
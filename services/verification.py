@@ -2,46 +2,88 @@
 import time
 import random
 import string
+import asyncio
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from io import BytesIO
 from captcha.image import ImageCaptcha
+from PIL import Image
+from utils.timer_wheel import expiry_wheel
+from utils import metrics
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import select, delete
+from database import AsyncSessionLocal, PendingVerification
+import config
 
+# How long a new member has to solve the captcha before being kicked
+VERIFICATION_TIMEOUT = 180
+# Expired verifications handled per sweep query
+EXPIRY_BATCH_SIZE = 100
+
+# In-memory mirror of the pending_verifications table (restored on startup)
+# Format: {user_id: {"time": sent_at_epoch, "correct": answer}}
 _pending_verifications = {}
+# Verifications whose row could not be saved yet. save_unsaved_verifications() retries them,
+# and the expiry sweep kicks them from here if they never make it into the table.
+# Format: {user_id: {PendingVerification column: value}}
+_unsaved_verifications = {}
+
+# --- CAPTCHA POOL ---
+# Rendering is CPU-bound, so it happens in worker processes ahead of time.
+# Joins just pop a ready captcha (a dict from render_captcha).
+_captcha_pool = deque()
+_pool_executor = None
+_pool_task = None
+_pool_wakeup = None
+
+# --- COST TIERS ---
+# During a join raid we switch to cheaper captchas so rendering keeps up.
+CAPTCHA_TIERS = [
+    {'name': 'full', 'width': 300, 'height': 100, 'frames': 8, 'format': 'gif'},
+    {'name': 'reduced', 'width': 240, 'height': 80, 'frames': 4, 'format': 'gif'},
+    {'name': 'static', 'width': 200, 'height': 70, 'frames': 1, 'format': 'png'},
+]
+TIER_COOLDOWN = 60        # seconds of calm before stepping back up to a stronger tier
+JOIN_RATE_WINDOW = 60     # seconds
+
+_current_tier = 0
+_tier_raised_at = 0.0
+_recent_joins = deque()   # monotonic timestamps of recent captcha requests
+_render_latency = 0.0     # EWMA of seconds from "render requested" to "captcha ready"
 
-def generate_gif_captcha(user_id: int):
+def render_captcha(tier: int = 0):
     """
-    Generates a rapid-flashing animated GIF captcha.
+    Generates a rapid-flashing animated GIF captcha (or a static PNG on the cheapest tier).
     Optimized to defeat OCR bots while remaining readable to humans.
+    Runs inside a worker process.
     """
+    spec = CAPTCHA_TIERS[tier]
+    started = time.perf_counter()
+
     # 1. Generate the correct 4-character string (No ambiguous characters)
     characters = "ABCDEFGHJKLMNPQRSTUVWXYZ23456789"
     correct_ans = ''.join(random.choices(characters, k=4))
     
     # 2. Setup the generator
     # We use a slightly wider canvas to give the characters room to warp
-    image_generator = ImageCaptcha(width=300, height=100)
+    image_generator = ImageCaptcha(width=spec['width'], height=spec['height'])
     frames = []
     
     # 3. Generate MORE frames for a chaotic, unreadable-by-bot sequence
     # 8 frames ensures the noise lines constantly shift positions.
-    for _ in range(8):
+    for _ in range(spec['frames']):
         # The library automatically applies random warp, noise curves, and dots per frame
         frame = image_generator.generate_image(correct_ans)
         frames.append(frame)
         
     # 4. Stitch into a high-speed GIF
-    gif_io = BytesIO()
-    # duration=100 means 10 frames per second. Fast enough to blur the noise for humans,
-    # but completely breaks frame-by-frame OCR analysis.
-    frames[0].save(
-        gif_io, 
-        format='GIF', 
-        save_all=True, 
-        append_images=frames[1:], 
-        duration=200, 
-        loop=0
-    )
-    gif_io.seek(0)
-    gif_io.name = "captcha.gif"
+    if spec['format'] == 'png':
+        image_io = BytesIO()
+        frames[0].save(image_io, format='PNG', optimize=True)
+        data = image_io.getvalue()
+    else:
+        data = _encode_gif(frames, config.CAPTCHA_GIF_MAX_BYTES)
     
     # 5. Create a pool of 6 answers
     answers = [correct_ans]
@@ -69,16 +111,321 @@ def generate_gif_captcha(user_id: int):
     # Shuffle so the correct answer isn't always the first button
     random.shuffle(answers)
     
+    return {
+        'data': data,
+        'format': spec['format'],
+        'tier': tier,
+        'correct': correct_ans,
+        'answers': answers,
+        'render_seconds': time.perf_counter() - started
+    }
+
+# Palette sizes tried in order until the GIF fits the byte budget
+GIF_PALETTE_STEPS = (32, 16, 8)
+
+def _encode_gif(frames, max_bytes: int) -> bytes:
+    """
+    Encodes the frames as one GIF that shares a single small palette.
+
+    Pillow would otherwise quantize every RGB frame to its own 256-colour palette.
+    Frames are still cropped to the area that changed since the previous frame.
+    If the result is over max_bytes, fewer colours and then fewer frames are tried.
+    """
+    data = b''
+    while True:
+        for colors in GIF_PALETTE_STEPS:
+            data = _encode_gif_once(frames, colors)
+            if len(data) <= max_bytes:
+                return data
+        if len(frames) <= 2:
+            return data # Smallest we can go, send it anyway
+        frames = frames[::2]
+
+def _encode_gif_once(frames, colors: int) -> bytes:
+    width, height = frames[0].size
+
+    # Quantize all frames in one pass (stacked into a single sheet) so they share a palette
+    sheet = Image.new('RGB', (width, height * len(frames)))
+    for i, frame in enumerate(frames):
+        sheet.paste(frame, (0, i * height))
+    sheet = sheet.quantize(colors=colors, method=Image.Quantize.MEDIANCUT, dither=Image.Dither.NONE)
+    paletted = [sheet.crop((0, i * height, width, (i + 1) * height)) for i in range(len(frames))]
+
+    image_io = BytesIO()
+    # duration=200 means 5 frames per second. Fast enough to blur the noise for humans,
+    # but completely breaks frame-by-frame OCR analysis.
+    paletted[0].save(
+        image_io,
+        format='GIF',
+        save_all=True,
+        append_images=paletted[1:],
+        duration=200,
+        loop=0
+    )
+    return image_io.getvalue()
+
+def _select_tier() -> int:
+    """
+    Picks the captcha tier from the recent join rate and how long renders are taking.
+    Steps down (cheaper) immediately, steps back up only after TIER_COOLDOWN seconds of calm.
+    """
+    global _current_tier, _tier_raised_at
+    now = time.monotonic()
+    while _recent_joins and now - _recent_joins[0] > JOIN_RATE_WINDOW:
+        _recent_joins.popleft()
+
+    joins_per_minute = len(_recent_joins) * 60 / JOIN_RATE_WINDOW
+    raid = config.CAPTCHA_RAID_JOINS_PER_MIN
+
+    wanted = 0
+    if joins_per_minute >= raid * 3:
+        wanted = 2
+    elif joins_per_minute >= raid:
+        wanted = 1
+    # Renders falling behind pushes us one tier cheaper on top of that
+    if _render_latency > config.CAPTCHA_MAX_RENDER_LATENCY:
+        wanted = min(wanted + 1, len(CAPTCHA_TIERS) - 1)
+
+    if wanted > _current_tier:
+        _current_tier = wanted
+        _tier_raised_at = now
+        print(f"🛡 Captcha tier -> {CAPTCHA_TIERS[wanted]['name']} ({joins_per_minute:.0f} joins/min)")
+    elif wanted < _current_tier and now - _tier_raised_at >= TIER_COOLDOWN:
+        _current_tier -= 1
+        _tier_raised_at = now
+        print(f"🛡 Captcha tier -> {CAPTCHA_TIERS[_current_tier]['name']}")
+
+    metrics.set_gauge('captcha_tier', _current_tier)
+    return _current_tier
+
+async def _render(tier: int):
+    """Renders one captcha in the worker pool and records how it went."""
+    global _render_latency
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    if _pool_executor:
+        captcha = await loop.run_in_executor(_pool_executor, render_captcha, tier)
+    else:
+        captcha = await asyncio.to_thread(render_captcha, tier)
+
+    # Wall time includes waiting behind other renders, which is what joiners feel
+    latency = loop.time() - started
+    _render_latency = latency if _render_latency == 0.0 else 0.8 * _render_latency + 0.2 * latency
+
+    name = CAPTCHA_TIERS[tier]['name']
+    metrics.observe('captcha_render_seconds', captcha['render_seconds'], tier=name)
+    metrics.observe('captcha_bytes', len(captcha['data']), tier=name)
+    return captcha
+
+def start_captcha_pool():
+    """Starts the worker processes and the task that keeps the pool topped up."""
+    global _pool_executor, _pool_task, _pool_wakeup
+    # 'spawn' gives every worker a fresh interpreter (and a fresh random seed)
+    _pool_executor = ProcessPoolExecutor(
+        max_workers=config.CAPTCHA_POOL_WORKERS,
+        mp_context=multiprocessing.get_context('spawn')
+    )
+    _pool_wakeup = asyncio.Event()
+    _pool_task = asyncio.get_running_loop().create_task(_refill_pool())
+
+async def stop_captcha_pool():
+    global _pool_executor, _pool_task
+    if _pool_task:
+        _pool_task.cancel()
+        _pool_task = None
+    if _pool_executor:
+        _pool_executor.shutdown(wait=False, cancel_futures=True)
+        _pool_executor = None
+
+def _drop_weaker_captchas(tier: int):
+    """Once the raid is over, pooled captchas from a cheaper tier are thrown away (and re-rendered)."""
+    global _captcha_pool
+    if any(captcha['tier'] > tier for captcha in _captcha_pool):
+        kept = deque(captcha for captcha in _captcha_pool if captcha['tier'] <= tier)
+        metrics.inc('captcha_pool_dropped_total', len(_captcha_pool) - len(kept))
+        _captcha_pool = kept
+
+async def _refill_pool():
+    loop = asyncio.get_running_loop()
+    while True:
+        tier = _select_tier()
+        _drop_weaker_captchas(tier)
+        missing = config.CAPTCHA_POOL_DEPTH - len(_captcha_pool)
+        metrics.set_gauge('captcha_pool_depth', len(_captcha_pool))
+        if missing <= 0:
+            _pool_wakeup.clear()
+            # Wake up now and then even without joins, so a calm pool can step back up a tier
+            try:
+                await asyncio.wait_for(_pool_wakeup.wait(), timeout=TIER_COOLDOWN)
+            except asyncio.TimeoutError:
+                pass
+            continue
+
+        # One render per worker at a time, no faster than CAPTCHA_REFILL_RATE per second
+        batch = min(missing, config.CAPTCHA_POOL_WORKERS)
+        started = loop.time()
+        results = await asyncio.gather(*(_render(tier) for _ in range(batch)), return_exceptions=True)
+        for result in results:
+            if isinstance(result, Exception):
+                print(f"❌ Captcha render failed: {result}")
+            else:
+                _captcha_pool.append(result)
+
+        min_duration = batch / config.CAPTCHA_REFILL_RATE
+        await asyncio.sleep(max(0.0, min_duration - (loop.time() - started)))
+
+async def issue_captcha(user_id: int):
+    """
+    Hands out a captcha for this user and starts their verification.
+    Returns (image_io, answers, format) where format is 'gif' or 'png'.
+    """
+    _recent_joins.append(time.monotonic())
+    tier = _select_tier()
+    _drop_weaker_captchas(tier)
+
+    if _captcha_pool:
+        captcha = _captcha_pool.popleft()
+    else:
+        # Pool ran dry (big raid): render this one directly, still off the event loop
+        metrics.inc('captcha_pool_misses_total')
+        captcha = await _render(tier)
+
+    if _pool_wakeup:
+        _pool_wakeup.set()
+    metrics.inc('captcha_issued_total', tier=CAPTCHA_TIERS[captcha['tier']]['name'])
+
+    image_io = BytesIO(captcha['data'])
+    image_io.name = f"captcha.{captcha['format']}"
+
     _pending_verifications[user_id] = {
         "time": time.time(),
-        "correct": correct_ans
+        "correct": captcha['correct']
     }
+    # Safety net: forget the challenge even if the timeout task never runs
+    expiry_wheel.expire_after(_pending_verifications, user_id, VERIFICATION_TIMEOUT + 60)
     
-    return gif_io, answers
+    return image_io, captcha['answers'], captcha['format']
 
 def get_verification(user_id: int):
     return _pending_verifications.get(user_id)
 
-def clear_verification(user_id: int):
-    if user_id in _pending_verifications:
-        del _pending_verifications[user_id]
\ No newline at end of file
+async def save_verification(user_id: int, chat_id: int, message_id: int):
+    """
+    Persists a pending captcha once its message is sent, so the timeout survives restarts.
+    The timeout counts from now: the send may have waited in the rate limiter for a while.
+    """
+    pending = _pending_verifications.get(user_id)
+    if not pending:
+        return
+    pending['time'] = time.time()
+    expiry_wheel.expire_after(_pending_verifications, user_id, VERIFICATION_TIMEOUT + 60)
+    sent_at = datetime.utcfromtimestamp(pending['time'])
+    row = {
+        'chat_id': chat_id,
+        'message_id': message_id,
+        'correct': pending['correct'],
+        'created_at': sent_at,
+        'expires_at': sent_at + timedelta(seconds=VERIFICATION_TIMEOUT)
+    }
+
+    async with AsyncSessionLocal() as session:
+        try:
+            await session.merge(PendingVerification(user_id=user_id, **row))
+            await session.commit()
+            return
+        except Exception as e:
+            print(f"❌ Error saving verification for {user_id}, retrying in the background: {e}")
+    # No waiting in the join handler: the expiry job retries it (and kicks on time regardless)
+    _unsaved_verifications[user_id] = row
+
+async def save_unsaved_verifications():
+    """Retries the rows save_verification couldn't write. Called by the expiry job."""
+    if not _unsaved_verifications:
+        return
+    now = datetime.utcnow()
+    batch = {user_id: row for user_id, row in _unsaved_verifications.items() if row['expires_at'] > now}
+    if not batch:
+        return
+    async with AsyncSessionLocal() as session:
+        try:
+            for user_id, row in batch.items():
+                await session.merge(PendingVerification(user_id=user_id, **row))
+            await session.commit()
+        except Exception as e:
+            print(f"❌ Still can't save {len(batch)} verifications: {e}")
+            return
+
+        # Answered while we were saving: that row must not kick them later
+        answered = [user_id for user_id in batch if user_id not in _unsaved_verifications]
+        for user_id in batch:
+            _unsaved_verifications.pop(user_id, None)
+        if answered:
+            try:
+                await session.execute(delete(PendingVerification).where(PendingVerification.user_id.in_(answered)))
+                await session.commit()
+            except Exception as e:
+                print(f"❌ Error clearing answered verifications: {e}")
+
+async def clear_verification(user_id: int):
+    _pending_verifications.pop(user_id, None)
+    _unsaved_verifications.pop(user_id, None)
+    async with AsyncSessionLocal() as session:
+        try:
+            await session.execute(delete(PendingVerification).where(PendingVerification.user_id == user_id))
+            await session.commit()
+        except Exception as e:
+            print(f"❌ Error clearing verification for {user_id}: {e}")
+
+async def restore_verifications():
+    """Startup: reloads pending captchas so answers still work and timeouts still fire."""
+    async with AsyncSessionLocal() as session:
+        result = await session.execute(select(PendingVerification))
+        rows = result.scalars().all()
+
+    for row in rows:
+        _pending_verifications[row.user_id] = {
+            "time": row.created_at.replace(tzinfo=timezone.utc).timestamp(),
+            "correct": row.correct
+        }
+        expiry_wheel.expire_after(_pending_verifications, row.user_id, VERIFICATION_TIMEOUT + 60)
+    if rows:
+        print(f"🛡 Restored {len(rows)} pending verifications")
+
+async def claim_expired_verifications(limit: int = EXPIRY_BATCH_SIZE):
+    """
+    Removes up to `limit` of the earliest expired verifications and returns them
+    as [(user_id, chat_id, message_id)]. Deleting with RETURNING means each row is
+    handed to exactly one caller, even if several processes sweep at once.
+    Verifications that never made it into the table are handed out from memory.
+    """
+    now = datetime.utcnow()
+    rows = []
+    for user_id, row in list(_unsaved_verifications.items()):
+        if len(rows) < limit and row['expires_at'] <= now:
+            del _unsaved_verifications[user_id]
+            rows.append((user_id, row['chat_id'], row['message_id']))
+
+    if len(rows) < limit:
+        async with AsyncSessionLocal() as session:
+            try:
+                due = (
+                    select(PendingVerification.user_id)
+                    .where(PendingVerification.expires_at <= now)
+                    .order_by(PendingVerification.expires_at)
+                    .limit(limit - len(rows))
+                )
+                result = await session.execute(
+                    delete(PendingVerification)
+                    .where(PendingVerification.user_id.in_(due))
+                    .where(PendingVerification.expires_at <= now)
+                    .returning(PendingVerification.user_id, PendingVerification.chat_id, PendingVerification.message_id)
+                )
+                claimed = result.all()
+                await session.commit()
+                rows.extend(claimed)
+            except Exception as e:
+                print(f"❌ Error claiming expired verifications: {e}")
+
+    for user_id, _, _ in rows:
+        _pending_verifications.pop(user_id, None)
+    return rows
@@ -0,0 +1,61 @@
+# services/wheel.py
+import json
+import time
+import asyncio
+import hashlib
+from sqlalchemy import select
+from database import AsyncSessionLocal, Product
+
+# Safety net in case a stock change happens somewhere that doesn't call invalidate()
+CACHE_SECONDS = 60
+
+# Format: (built_at, body_bytes, etag)
+_cached = None
+_generation = 0   # Bumped by invalidate(); a build that started before it is thrown away
+_build_lock = asyncio.Lock()
+
+def invalidate():
+    """Call after adding/removing a lottery product or changing its stock."""
+    global _cached, _generation
+    _cached = None
+    _generation += 1
+
+async def get_wheel_payload():
+    """
+    Returns (json_body_bytes, etag) for /api/wheel_data, rebuilding it only when
+    the lottery products changed (or the cache is older than CACHE_SECONDS).
+    """
+    cached = _cached
+    if cached and time.monotonic() - cached[0] < CACHE_SECONDS:
+        return cached[1], cached[2]
+
+    async with _build_lock:
+        # Someone else may have rebuilt it while we waited
+        cached = _cached
+        if cached and time.monotonic() - cached[0] < CACHE_SECONDS:
+            return cached[1], cached[2]
+        return await _build()
+
+async def _build():
+    global _cached
+    generation = _generation
+    async with AsyncSessionLocal() as session:
+        result = await session.execute(
+            select(Product.id, Product.name, Product.cost, Product.chance)
+            .filter_by(is_active=True, type='lottery').filter(Product.stock > 0)
+        )
+        products = result.all()
+
+    total_win_chance = sum(p.chance for p in products)
+    # Normalize chances if they exceed 100% (1.0)
+    scale = 1.0 / total_win_chance if total_win_chance > 1.0 else 1.0
+    lose_chance = max(0.0, 1.0 - total_win_chance * scale)
+
+    items = [{"id": p.id, "name": p.name, "cost": p.cost, "chance": p.chance * scale} for p in products]
+    items.append({"id": -1, "name": "谢谢惠顾", "cost": 0, "chance": lose_chance})
+
+    body = json.dumps(items, ensure_ascii=False).encode()
+    etag = f'"{hashlib.sha1(body).hexdigest()[:20]}"'
+    if generation == _generation:
+        _cached = (time.monotonic(), body, etag)
+    return body, etag
@@ -1,31 +1,81 @@
 # ruanbot/utils/admin_cache.py
 import time
+import asyncio
+from telegram import ChatMember
+import config
 
 # In-memory dictionary to store admin lists.
-# Format: {chat_id: (timestamp, [admin_user_ids])}
-_admin_cache = {} 
-CACHE_DURATION = 900  # 15 minutes in seconds
+# Format: {chat_id: (timestamp, {admin_user_ids})}
+_admin_cache = {}
+# Format: {chat_id: timestamp_of_last_failed_fetch}
+_failed_fetches = {}
+# Format: {chat_id: asyncio.Task} (at most one get_chat_administrators call per chat at a time)
+_inflight = {}
+
+# Promotions/demotions are pushed in by ChatMember updates, so a full refetch is only a safety net
+CACHE_DURATION = config.ADMIN_CACHE_SECONDS
+FAILURE_CACHE_DURATION = 60  # Don't hammer the API when the bot lacks permissions
 
 async def is_user_admin(chat_id: int, user_id: int, bot) -> bool:
     """
     Checks if a user is an admin in a specific chat.
-    Uses a 15-minute cache to avoid Telegram API rate limits.
+    Expired lists are still answered from memory while a refresh runs in the background.
     """
     now = time.time()
-    
-    # 1. Check if we have a valid cache for this group
-    if chat_id in _admin_cache and (now - _admin_cache[chat_id][0]) < CACHE_DURATION:
-        admin_ids = _admin_cache[chat_id][1]
+    cached = _admin_cache.get(chat_id)
+
+    # 1. We have a list (maybe stale): answer right away
+    if cached:
+        if now - cached[0] >= CACHE_DURATION and not _recently_failed(chat_id, now):
+            _refresh(chat_id, bot)
+        return user_id in cached[1]
+
+    # 2. Nothing cached and the last fetch failed: safe fallback without another API call
+    if _recently_failed(chat_id, now):
+        return False
+
+    # 3. Nothing cached: wait for the (shared) fetch
+    admin_ids = await asyncio.shield(_refresh(chat_id, bot))
+    if admin_ids is None:
+        return False # Safe fallback if bot lacks permissions
+    return user_id in admin_ids
+
+def apply_member_update(chat_member_update):
+    """
+    Applies a promotion or demotion seen in a ChatMember update directly to the cache.
+    """
+    cached = _admin_cache.get(chat_member_update.chat.id)
+    if not cached:
+        return # Nothing to patch, the next lookup fetches a fresh list
+
+    new_member = chat_member_update.new_chat_member
+    if new_member.status in (ChatMember.ADMINISTRATOR, ChatMember.OWNER):
+        cached[1].add(new_member.user.id)
     else:
-        # 2. Cache is missing or expired, fetch a fresh list from Telegram
-        try:
-            admins = await bot.get_chat_administrators(chat_id)
-            admin_ids = [admin.user.id for admin in admins]
-            # Update the cache with the current time
-            _admin_cache[chat_id] = (now, admin_ids)
-        except Exception as e:
-            print(f"⚠️ Error fetching admins for chat {chat_id}: {e}")
-            return False # Safe fallback if bot lacks permissions
-            
-    # 3. Return True if the user is in the admin list
-    return user_id in admin_ids
\ No newline at end of file
+        cached[1].discard(new_member.user.id)
+
+def _recently_failed(chat_id: int, now: float) -> bool:
+    failed_at = _failed_fetches.get(chat_id)
+    return failed_at is not None and now - failed_at < FAILURE_CACHE_DURATION
+
+def _refresh(chat_id: int, bot) -> asyncio.Task:
+    """Starts a fetch for this chat, or joins the one already running."""
+    task = _inflight.get(chat_id)
+    if task is None:
+        task = asyncio.get_running_loop().create_task(_fetch_admins(chat_id, bot))
+        _inflight[chat_id] = task
+        task.add_done_callback(lambda _: _inflight.pop(chat_id, None))
+    return task
+
+async def _fetch_admins(chat_id: int, bot):
+    try:
+        admins = await bot.get_chat_administrators(chat_id)
+    except Exception as e:
+        print(f"⚠️ Error fetching admins for chat {chat_id}: {e}")
+        _failed_fetches[chat_id] = time.time()
+        return None
+
+    admin_ids = {admin.user.id for admin in admins}
+    _admin_cache[chat_id] = (time.time(), admin_ids)
+    _failed_fetches.pop(chat_id, None)
+    return admin_ids
@@ -0,0 +1,53 @@
+# utils/metrics.py
+# Tiny in-process metrics registry, served in Prometheus text format at /metrics.
+
+# Format: {(name, (("label", "value"), ...)): value}
+_counters = {}
+_gauges = {}
+# Format: {(name, labels): [count, sum, max]}
+_summaries = {}
+
+def _key(name: str, labels: dict):
+    return (name, tuple(sorted(labels.items())))
+
+def inc(name: str, value: float = 1, **labels):
+    """Adds to a counter."""
+    key = _key(name, labels)
+    _counters[key] = _counters.get(key, 0) + value
+
+def set_gauge(name: str, value: float, **labels):
+    """Sets a value that can go up and down (queue depth, current tier...)."""
+    _gauges[_key(name, labels)] = value
+
+def observe(name: str, value: float, **labels):
+    """Records one sample (a duration, a size...). Exported as count, sum and max."""
+    key = _key(name, labels)
+    summary = _summaries.get(key)
+    if summary is None:
+        _summaries[key] = [1, value, value]
+    else:
+        summary[0] += 1
+        summary[1] += value
+        if value > summary[2]:
+            summary[2] = value
+
+def get_counter(name: str, **labels) -> float:
+    return _counters.get(_key(name, labels), 0)
+
+def _format(name: str, labels, value) -> str:
+    if labels:
+        label_text = ",".join(f'{k}="{v}"' for k, v in labels)
+        return f"{name}{{{label_text}}} {value}"
+    return f"{name} {value}"
+
+def render() -> str:
+    lines = []
+    for (name, labels), value in sorted(_counters.items()):
+        lines.append(_format(name, labels, value))
+    for (name, labels), value in sorted(_gauges.items()):
+        lines.append(_format(name, labels, value))
+    for (name, labels), (count, total, peak) in sorted(_summaries.items()):
+        lines.append(_format(f"{name}_count", labels, count))
+        lines.append(_format(f"{name}_sum", labels, total))
+        lines.append(_format(f"{name}_max", labels, peak))
+    return "\n".join(lines) + "\n"
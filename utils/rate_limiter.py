@@ -0,0 +1,180 @@
+# utils/rate_limiter.py
+import time
+import asyncio
+import itertools
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+from utils import metrics
+from utils.update_processor import slot_released
+import config
+
+# --- PRIORITIES ---
+# Lower number goes first. Pass rate_limit_args=NOTIFICATION (or DELETION) to any bot
+# method to queue it behind interactive traffic; everything else defaults by endpoint.
+INTERACTIVE = 0
+NOTIFICATION = 1
+DELETION = 2
+PRIORITY_NAMES = {INTERACTIVE: 'interactive', NOTIFICATION: 'notification', DELETION: 'deletion'}
+
+_DELETION_ENDPOINTS = {'deleteMessage', 'deleteMessages'}
+MAX_TRACKED_CHATS = 10000
+# A call still waiting after this long gives its update processing slot back until it may go
+SLOT_RELEASE_AFTER = 0.05
+
+def _counts_against_chat(endpoint: str) -> bool:
+    """Telegram's per-chat limits are about new messages showing up in the chat."""
+    return endpoint.startswith(('send', 'copy', 'forward'))
+
+class _Bucket:
+    """Token bucket. `blocked_until` is set from a 429's retry_after."""
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated', 'blocked_until')
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate            # tokens per second
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def _refill(self, now: float):
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def ready_in(self, now: float) -> float:
+        """Seconds until a token can be taken (0 = now)."""
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+class OutboundRateLimiter(BaseRateLimiter):
+    """
+    Central scheduler for every Bot API call (plugged in via ApplicationBuilder.rate_limiter).
+
+    Calls wait in one queue ordered by (priority, arrival). Each call needs a token from the
+    global bucket and, for message-creating endpoints, from its chat's bucket (groups and
+    private chats have different budgets). A throttled chat never holds up other chats.
+    A 429 pauses the chat (or everything, if no chat is involved) for retry_after and the
+    call is retried.
+    """
+    def __init__(self):
+        self._global = _Bucket(config.SEND_GLOBAL_PER_SECOND, config.SEND_GLOBAL_PER_SECOND)
+        self._chats = {}    # {chat_id: _Bucket}
+        self._waiting = []  # [(priority, seq, chat_id, future)]
+        self._seq = itertools.count()
+        self._wakeup = None
+        self._dispatcher = None
+
+    async def initialize(self):
+        self._wakeup = asyncio.Event()
+        self._dispatcher = asyncio.get_running_loop().create_task(self._dispatch())
+
+    async def shutdown(self):
+        if self._dispatcher:
+            self._dispatcher.cancel()
+            self._dispatcher = None
+        for *_, future in self._waiting:
+            future.cancel()
+        self._waiting.clear()
+
+    def _chat_bucket(self, chat_id) -> _Bucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) >= MAX_TRACKED_CHATS:
+                self._prune()
+            # Negative IDs and @usernames are groups/channels
+            if isinstance(chat_id, str) or chat_id < 0:
+                per_minute = config.SEND_GROUP_PER_MINUTE
+                bucket = _Bucket(per_minute / 60, per_minute)
+            else:
+                bucket = _Bucket(config.SEND_PRIVATE_PER_SECOND, config.SEND_PRIVATE_PER_SECOND)
+            self._chats[chat_id] = bucket
+        return bucket
+
+    def _prune(self):
+        """Forgets chats whose bucket is full again (they'd behave exactly like a new one)."""
+        now = time.monotonic()
+        self._chats = {
+            chat_id: bucket for chat_id, bucket in self._chats.items()
+            if bucket.ready_in(now) > 0 or bucket.tokens < bucket.capacity
+        }
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        if isinstance(rate_limit_args, int):
+            priority = rate_limit_args
+        else:
+            priority = DELETION if endpoint in _DELETION_ENDPOINTS else INTERACTIVE
+        chat_id = data.get('chat_id') if _counts_against_chat(endpoint) else None
+        label = PRIORITY_NAMES.get(priority, str(priority))
+
+        for attempt in range(config.SEND_MAX_RETRIES + 1):
+            await self._acquire(priority, chat_id, label)
+            try:
+                return await callback(*args, **kwargs)
+            except RetryAfter as e:
+                retry_after = e.retry_after.total_seconds() if hasattr(e.retry_after, 'total_seconds') else e.retry_after
+                metrics.inc('telegram_retry_after_total', endpoint=endpoint)
+                print(f"⏳ Telegram asked us to wait {retry_after}s ({endpoint})")
+                bucket = self._chat_bucket(chat_id) if chat_id is not None else self._global
+                bucket.blocked_until = max(bucket.blocked_until, time.monotonic() + retry_after)
+                if attempt == config.SEND_MAX_RETRIES:
+                    raise
+
+    async def _acquire(self, priority: int, chat_id, label: str):
+        future = asyncio.get_running_loop().create_future()
+        self._waiting.append((priority, next(self._seq), chat_id, future))
+        metrics.set_gauge('send_queue_depth', len(self._waiting))
+        self._wakeup.set()
+
+        queued_at = time.monotonic()
+        try:
+            done, _ = await asyncio.wait((future,), timeout=SLOT_RELEASE_AFTER)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        if not done:
+            # Throttled: don't keep an update processing slot busy while waiting,
+            # one group at its per-minute limit would otherwise tie up every slot
+            async with slot_released():
+                await future
+        metrics.observe('send_queue_wait_seconds', time.monotonic() - queued_at, priority=label)
+        metrics.inc('telegram_requests_total', priority=label)
+
+    async def _dispatch(self):
+        while True:
+            self._wakeup.clear()
+            next_check = None
+
+            if self._waiting:
+                self._waiting.sort(key=lambda waiter: (waiter[0], waiter[1]))
+                still_waiting = []
+                now = time.monotonic()
+                for waiter in self._waiting:
+                    chat_id, future = waiter[2], waiter[3]
+                    if future.done():
+                        continue # Caller was cancelled
+                    wait = self._global.ready_in(now)
+                    chat_bucket = self._chat_bucket(chat_id) if chat_id is not None else None
+                    if chat_bucket:
+                        wait = max(wait, chat_bucket.ready_in(now))
+                    if wait == 0:
+                        self._global.take()
+                        if chat_bucket:
+                            chat_bucket.take()
+                        future.set_result(None)
+                    else:
+                        still_waiting.append(waiter)
+                        next_check = wait if next_check is None else min(next_check, wait)
+                self._waiting = still_waiting
+                metrics.set_gauge('send_queue_depth', len(self._waiting))
+
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=next_check)
+            except asyncio.TimeoutError:
+                pass
@@ -0,0 +1,122 @@
+# utils/static_assets.py
+import os
+import re
+import gzip
+import hashlib
+import mimetypes
+from aiohttp import web
+
+try:
+    import brotli # Optional: without it we serve gzip only
+except ImportError:
+    brotli = None
+
+# Hashed assets never change under the same URL, so browsers may keep them forever
+IMMUTABLE = 'public, max-age=31536000, immutable'
+# Pages keep a fixed URL: cache them but revalidate (cheap 304) on every open
+REVALIDATE = 'no-cache'
+
+_PLACEHOLDER_RE = re.compile(r'\{\{([\w.\-]+)\}\}')
+
+class _Asset:
+    """One file held in memory with its precompressed variants."""
+    __slots__ = ('content_type', 'cache_control', 'variants')
+
+    def __init__(self, body: bytes, content_type: str, cache_control: str):
+        self.content_type = content_type
+        self.cache_control = cache_control
+        digest = hashlib.sha1(body).hexdigest()[:16]
+        # Format: {encoding: (bytes, etag)}. Every encoding is its own representation, so its own ETag.
+        self.variants = {'identity': (body, f'"{digest}"')}
+        if brotli:
+            compressed = brotli.compress(body, quality=11)
+            if len(compressed) < len(body):
+                self.variants['br'] = (compressed, f'"{digest}-br"')
+        compressed = gzip.compress(body, compresslevel=9, mtime=0)
+        if len(compressed) < len(body):
+            self.variants['gzip'] = (compressed, f'"{digest}-gz"')
+
+def _accepted_encodings(header: str) -> set:
+    """Encodings the client accepts (anything listed without q=0)."""
+    accepted = set()
+    for part in header.split(','):
+        name, _, params = part.partition(';')
+        params = params.replace(' ', '')
+        if params.startswith('q='):
+            try:
+                if float(params[2:]) == 0:
+                    continue
+            except ValueError:
+                continue
+        accepted.add(name.strip().lower())
+    return accepted
+
+class StaticAssets:
+    """
+    Loads a directory once at startup and serves it from memory.
+
+    Every file except the pages is published under a content-hashed name
+    (wheel.css -> /static/wheel.3f2a9c1e.css) with a one-year immutable Cache-Control.
+    Pages may reference assets as {{wheel.css}}; the placeholder is replaced with the
+    hashed URL, so a new deploy changes the URL and repeat opens hit the browser cache.
+    Responses are negotiated between brotli, gzip and identity and carry an ETag.
+    """
+    def __init__(self, directory: str, pages=('index.html',), url_prefix: str = '/static/'):
+        self.url_prefix = url_prefix
+        self._assets = {}   # {url_path: _Asset}
+        self.urls = {}      # {file_name: hashed_url}
+
+        for name in sorted(os.listdir(directory)):
+            path = os.path.join(directory, name)
+            if name in pages or not os.path.isfile(path):
+                continue
+            with open(path, 'rb') as f:
+                body = f.read()
+            stem, ext = os.path.splitext(name)
+            url = f"{url_prefix}{stem}.{hashlib.sha1(body).hexdigest()[:8]}{ext}"
+            self.urls[name] = url
+            self._assets[url] = _Asset(body, self._content_type(name), IMMUTABLE)
+
+        for name in pages:
+            with open(os.path.join(directory, name), encoding='utf-8') as f:
+                html = f.read()
+            html = _PLACEHOLDER_RE.sub(lambda m: self.urls[m.group(1)], html)
+            self._assets[f"/{name}"] = _Asset(html.encode(), self._content_type(name), REVALIDATE)
+
+    @staticmethod
+    def _content_type(name: str) -> str:
+        content_type = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+        if content_type.startswith('text/') or content_type in ('application/javascript', 'application/json'):
+            content_type += '; charset=utf-8'
+        return content_type
+
+    def response(self, request, url_path: str):
+        asset = self._assets.get(url_path)
+        if asset is None:
+            raise web.HTTPNotFound()
+
+        accepted = _accepted_encodings(request.headers.get('Accept-Encoding', ''))
+        encoding = 'identity'
+        for candidate in ('br', 'gzip'):
+            if candidate in asset.variants and candidate in accepted:
+                encoding = candidate
+                break
+        body, etag = asset.variants[encoding]
+
+        headers = {
+            'ETag': etag,
+            'Cache-Control': asset.cache_control,
+            'Vary': 'Accept-Encoding',
+            'Content-Type': asset.content_type,
+        }
+        if_none_match = request.headers.get('If-None-Match', '')
+        if if_none_match and (if_none_match.strip() == '*' or etag in [tag.strip() for tag in if_none_match.split(',')]):
+            return web.Response(status=304, headers=headers)
+
+        if encoding != 'identity':
+            headers['Content-Encoding'] = encoding
+        return web.Response(body=body, headers=headers)
+
+    async def handle(self, request):
+        """aiohttp handler for url_prefix + '{name}'."""
+        return self.response(request, request.path)
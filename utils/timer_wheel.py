@@ -0,0 +1,106 @@
+# utils/timer_wheel.py
+import time
+from telegram.ext import ContextTypes
+
+class TimerWheel:
+    """
+    Hierarchical timing wheel that deletes dict entries once they expire.
+
+    Call expire_after(mapping, key, ttl) every time an entry is written. Calling it
+    again for the same key just moves the deadline (no new timer is created).
+    advance() walks forward one tick at a time and pops whatever is due, so each
+    entry costs amortized O(1) no matter how many entries are being tracked.
+
+    An entry is never removed before its deadline. If a deadline is moved EARLIER,
+    the entry may be removed a little late (when its original slot comes round).
+    """
+    def __init__(self, tick: float = 1.0, slots: int = 64, levels: int = 3):
+        self.tick = tick
+        self.slots = slots
+        self.levels = levels
+        # _wheels[level][slot] -> list of entries; level L slots are slots**L ticks wide
+        self._wheels = [[[] for _ in range(slots)] for _ in range(levels)]
+        # {id(mapping): {key: entry}} where entry = [deadline, mapping, key]
+        self._entries = {}
+        self._current = int(time.monotonic() / tick)
+
+    def expire_after(self, mapping: dict, key, ttl: float, now: float = None):
+        """Removes mapping[key] once `ttl` seconds have passed since the last call for this key."""
+        deadline = (now if now is not None else time.monotonic()) + ttl
+        tracked = self._entries.get(id(mapping))
+        if tracked is None:
+            tracked = self._entries[id(mapping)] = {}
+
+        entry = tracked.get(key)
+        if entry is not None:
+            # Already sitting in a slot: it gets re-filed when that slot fires
+            entry[0] = deadline
+            return
+
+        entry = tracked[key] = [deadline, mapping, key]
+        self._place(entry)
+
+    def __len__(self) -> int:
+        return sum(len(tracked) for tracked in self._entries.values())
+
+    def _place(self, entry):
+        expires = int(entry[0] / self.tick) + 1
+        delta = max(0, expires - self._current)
+        slots = self.slots
+
+        for level in range(self.levels):
+            span = slots ** (level + 1)
+            if delta < span:
+                break
+        else:
+            # Further away than the whole wheel: park it in the last slot, it gets re-filed from there
+            expires = self._current + span - 1
+
+        idx = (expires // slots ** level) % slots
+        self._wheels[level][idx].append(entry)
+
+    def advance(self) -> int:
+        """Moves the wheel up to the current time. Returns how many entries were removed."""
+        now = time.monotonic()
+        target = int(now / self.tick)
+        slots = self.slots
+        removed = 0
+
+        while self._current < target:
+            self._current += 1
+            t = self._current
+
+            # 1. When a lower wheel wraps, pull the next slot of the wheel above it down.
+            #    Highest level first so its entries can cascade all the way to level 0.
+            top = 0
+            while top + 1 < self.levels and t % slots ** (top + 1) == 0:
+                top += 1
+            for level in range(top, 0, -1):
+                idx = (t // slots ** level) % slots
+                bucket = self._wheels[level][idx]
+                self._wheels[level][idx] = []
+                for entry in bucket:
+                    self._place(entry)
+
+            # 2. Fire the level 0 slot for this tick
+            idx = t % slots
+            bucket = self._wheels[0][idx]
+            self._wheels[0][idx] = []
+            for entry in bucket:
+                deadline, mapping, key = entry
+                if deadline <= now:
+                    del self._entries[id(mapping)][key]
+                    mapping.pop(key, None)
+                    removed += 1
+                else:
+                    # Deadline was pushed back since it was filed
+                    self._place(entry)
+
+        return removed
+
+# Shared by every module that keeps short-lived state in memory
+expiry_wheel = TimerWheel()
+
+async def advance_expiry_wheel(context: ContextTypes.DEFAULT_TYPE):
+    """Job: evicts expired antispam, verification and invite state."""
+    expiry_wheel.advance()
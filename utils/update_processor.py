@@ -0,0 +1,103 @@
+# utils/update_processor.py
+import asyncio
+import contextvars
+from contextlib import asynccontextmanager
+from telegram.ext import BaseUpdateProcessor
+
+class _Slot:
+    """The processing slot held by the update running in `task`."""
+    __slots__ = ('semaphore', 'task', 'held')
+
+    def __init__(self, semaphore, task):
+        self.semaphore = semaphore
+        self.task = task
+        self.held = True
+
+_current_slot = contextvars.ContextVar('current_slot', default=None)
+
+@asynccontextmanager
+async def slot_released():
+    """
+    Gives the current update's processing slot back while waiting on something slow
+    that isn't work (e.g. the outbound rate limiter), and takes one again afterwards.
+    The update keeps its per-user lock, so its user's updates still run in order.
+    """
+    slot = _current_slot.get()
+    # Only the task that owns the slot may lend it out (not tasks spawned from the handler)
+    if slot is None or not slot.held or slot.task is not asyncio.current_task():
+        yield
+        return
+    slot.held = False
+    slot.semaphore.release()
+    try:
+        yield
+    finally:
+        await slot.semaphore.acquire()
+        slot.held = True
+
+class UserOrderedUpdateProcessor(BaseUpdateProcessor):
+    """
+    Processes updates concurrently (up to max_concurrent_updates at once) while keeping
+    every update from the same user in arrival order.
+
+    Updates are sharded by user (or by chat when there is no user). A user's updates
+    queue on a per-user lock *before* taking a concurrency slot, so a user who sends a
+    burst never occupies more than one slot and can't starve everyone else.
+
+    BaseUpdateProcessor.process_update is final and holds the base class semaphore around
+    do_process_update, so that semaphore only caps how many updates are admitted (running
+    or waiting for their turn, max_queued_updates). The real slots are taken in here, and
+    handed back while a handler waits on the outbound rate limiter (see slot_released).
+    """
+    def __init__(self, max_concurrent_updates: int, max_queued_updates: int):
+        super().__init__(max(max_concurrent_updates, max_queued_updates))
+        self._slots = asyncio.Semaphore(max_concurrent_updates)
+        # Format: {key: [asyncio.Lock, number_of_updates_using_it]}
+        self._locks = {}
+
+    @staticmethod
+    def _key(update):
+        user = getattr(update, 'effective_user', None)
+        if user:
+            return ('user', user.id)
+        chat = getattr(update, 'effective_chat', None)
+        if chat:
+            return ('chat', chat.id)
+        return None
+
+    async def do_process_update(self, update, coroutine):
+        key = self._key(update)
+        if key is None:
+            await self._run(coroutine)
+            return
+
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            # asyncio.Lock wakes waiters first-come first-served, which keeps arrival order
+            async with entry[0]:
+                await self._run(coroutine)
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._locks[key]
+
+    async def _run(self, coroutine):
+        await self._slots.acquire()
+        slot = _Slot(self._slots, asyncio.current_task())
+        token = _current_slot.set(slot)
+        try:
+            await coroutine
+        finally:
+            _current_slot.reset(token)
+            # Not held if we were cancelled while taking it back in slot_released()
+            if slot.held:
+                self._slots.release()
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
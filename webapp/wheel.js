@@ -0,0 +1,132 @@
+const tg = window.Telegram.WebApp;
+tg.expand();
+
+if (tg.initDataUnsafe && tg.initDataUnsafe.user) {
+    document.getElementById('greeting').innerText = `欢迎, ${tg.initDataUnsafe.user.first_name}!`;
+}
+
+let theWheel;
+let isSpinning = false;
+let wheelData = [];
+
+// Beautiful pre-selected colors
+const colors = ["#feca57", "#ff6b6b", "#48dbfb", "#1dd1a1", "#ff9f43", "#5f27cd", "#c8d6e5"];
+
+// --- 1. Load Data & Initialize Winwheel ---
+async function loadWheelData() {
+    try {
+        const response = await fetch('/api/wheel_data');
+        wheelData = await response.json();
+
+        // Map the Python data into Winwheel's required format
+        let winwheelSegments = wheelData.map((sector, i) => {
+            return {
+                'id': sector.id,
+                'fillStyle': colors[i % colors.length],
+                'text': sector.name.length > 8 ? sector.name.substring(0,8) + ".." : sector.name,
+                'size': sector.chance * 360, // Directly converts chance (0.0 - 1.0) into degrees!
+                'textFontSize': 14,
+                'textFillStyle': '#ffffff'
+            };
+        });
+
+        // Create the Wheel Object!
+        theWheel = new Winwheel({
+            'canvasId': 'wheelCanvas',
+            'numSegments': winwheelSegments.length,
+            'outerRadius': 150,
+            'textFontSize': 16,
+            'textOrientation': 'horizontal', 
+            'textAlignment': 'outer',
+            'segments': winwheelSegments,
+            'lineWidth': 2,
+            'strokeStyle': '#ffffff',
+            'animation': {
+                'type': 'spinToStop',
+                'duration': 4, // 4 seconds of spinning
+                'spins': 7,    // 7 full rotations before stopping
+                'easing': 'Power3.easeOut', // Super smooth slow-down effect
+                'callbackFinished': 'alertPrize()'
+            }
+        });
+
+    } catch (error) {
+        document.getElementById('result-text').innerText = "加载数据失败，请重试";
+    }
+}
+
+// --- 2. Handle Spin Logic ---
+async function startSpin() {
+    if (isSpinning) return;
+    isSpinning = true;
+
+    document.getElementById('result-text').innerText = "🎰 抽奖中...";
+    document.getElementById('spinBtn').style.opacity = "0.5";
+
+    try {
+        // Fetch the winning index securely from Python
+        const response = await fetch('/api/spin', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ initData: tg.initData }) 
+        });
+
+        const result = await response.json();
+
+        if (!response.ok) {
+            tg.showAlert(result.error || "发生错误!");
+            resetUI();
+            return;
+        }
+
+        const winningId = result.winning_id;
+        let targetSegment = 1; // Default to first segment if not found
+
+        for (let i = 1; i <= theWheel.numSegments; i++) {
+            if (theWheel.segments[i].id === winningId) {
+                targetSegment = i;
+                break;
+            }
+        }
+
+        // Reset the wheel's rotation just in case they are spinning a 2nd time
+        theWheel.stopAnimation(false);
+        theWheel.rotationAngle = theWheel.rotationAngle % 360;
+
+        // Winwheel magically calculates the exact angle to land on!
+        let stopAt = theWheel.getRandomForSegment(targetSegment);
+
+        theWheel.animation.stopAngle = stopAt;
+
+        // Start the smooth animation
+        theWheel.startAnimation();
+
+    } catch (error) {
+        tg.showAlert("网络错误，请稍后重试。");
+        resetUI();
+    }
+}
+
+// --- 3. Finished Callback ---
+// This is automatically called by Winwheel when the spinning completely stops
+function alertPrize() {
+    const winningSegment = theWheel.getIndicatedSegment();
+    document.getElementById('result-text').innerText = `🎉 结果: ${winningSegment.text}`;
+
+    // Check if it's the "Lose" slice (We named it "谢谢惠顾" in Python)
+    if (winningSegment.text === "谢谢惠顾") {
+        tg.HapticFeedback.notificationOccurred("warning"); 
+    } else {
+        tg.HapticFeedback.notificationOccurred("success"); 
+    }
+
+    resetUI();
+}
+
+function resetUI() {
+    isSpinning = false;
+    document.getElementById('spinBtn').style.opacity = "1";
+}
+
+// Boot it up!
+loadWheelData();
@@ -1,6 +1,8 @@
 # ruanbot/webapp_server.py
 import os
+import re
 import json
+import asyncio
 import random
 import urllib.parse
 import hmac
@@ -12,6 +14,10 @@ import config
 from database import AsyncSessionLocal
 from models.product import Product
 from models.user import User
+from utils import metrics
+from utils.lru import LRUCache
+from utils.static_assets import StaticAssets
+from services import outbox, wheel
 
 _bot_instance = None
 
@@ -34,33 +40,22 @@ def verify_telegram_data(init_data: str, token: str) -> bool:
         return False
 
 # --- 2. Endpoints ---
+# The Mini App's files, loaded and precompressed once (relative to this file, not the working directory)
+_static = StaticAssets(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'webapp'))
+
 async def serve_index(request):
     """Serves the HTML spinning wheel page."""
-    # This assumes your index.html is inside the 'webapp' folder
-    return web.FileResponse('./webapp/index.html')
+    return _static.response(request, '/index.html')
 
 async def get_wheel_data(request):
     """Sends the active lottery products to the frontend, calculating exact chances."""
-    async with AsyncSessionLocal() as session:
-        result = await session.execute(
-            select(Product).filter_by(is_active=True, type='lottery').filter(Product.stock > 0)
-        )
-        products = result.scalars().all()
-    
-    total_win_chance = sum(p.chance for p in products)
-    
-    # NEW: Normalize chances if they exceed 100% (1.0)
-    if total_win_chance > 1.0:
-        for p in products:
-            p.chance = p.chance / total_win_chance
-        total_win_chance = 1.0
-        
-    lose_chance = max(0.0, 1.0 - total_win_chance) 
-    
-    items = [{"id": p.id, "name": p.name, "cost": p.cost, "chance": p.chance} for p in products]
-    items.append({"id": -1, "name": "谢谢惠顾", "cost": 0, "chance": lose_chance}) 
-    
-    return web.json_response(items)
+    body, etag = await wheel.get_wheel_payload()
+    headers = {'ETag': etag, 'Cache-Control': 'no-cache'} # Cache it, but always check the ETag
+
+    if_none_match = request.headers.get('If-None-Match', '')
+    if if_none_match and (if_none_match.strip() == '*' or etag in [tag.strip() for tag in if_none_match.split(',')]):
+        return web.Response(status=304, headers=headers)
+    return web.Response(body=body, content_type='application/json', headers=headers)
 
 async def spin_wheel(request):
     """Handles the actual spin logic securely with proportional probability."""
@@ -121,61 +116,153 @@ async def spin_wheel(request):
                 if p.stock <= 0:
                     await session.delete(p)
                 break
+
+        if won_product:
+            # Sent by the outbox once this commits
+            outbox.enqueue_admin_notice(session,
+                f"🎰 转盘中奖通知\n"
+                f"👤 用户: <a href='tg://user?id={user_id}'>{user_name}</a> (<code>{user_id}</code>)\n"
+                f"🎁 赢取: {won_product.name}\n"
+            )
                 
         await session.commit()
-
-    if won_product and _bot_instance and config.ADMIN_IDS:
-        notify_msg = (
-            f"🎰 转盘中奖通知\n"
-            f"👤 用户: <a href='tg://user?id={user_id}'>{user_name}</a> (<code>{user_id}</code>)\n"
-            f"🎁 赢取: {won_product.name}\n"
-        )
-        for admin_id in config.ADMIN_IDS:
-            try:
-                await _bot_instance.send_message(chat_id=admin_id, text=notify_msg, parse_mode='HTML')
-            except Exception as e:
-                print(f"Could not notify admin {admin_id}: {e}")   
+    outbox.wake()
+    if won_product:
+        wheel.invalidate() # Stock changed
 
     # FIX: Return the ID so the frontend doesn't get confused if the array shifts
     return web.json_response({"winning_id": winning_id, "message": "Success"})
 
 _app_instance = None # NEW: We need to store the whole application, not just the bot
 
-# --- NEW: Telegram Webhook Route ---
+# --- Telegram Webhook Route ---
+# The handler only authenticates, de-duplicates and queues the raw body, then answers.
+# Parsing into Update objects happens in _webhook_worker, off the request path.
+# An update counts as in flight from the moment it is accepted until the bot has finished
+# processing it; once WEBHOOK_QUEUE_SIZE are in flight we answer 503 and Telegram retries later.
+_UPDATE_ID_RE = re.compile(rb'"update_id"\s*:\s*(\d+)')
+# Telegram sends {"update_id":N,"<update type>":{...}}, so the type is the second key
+_UPDATE_TYPE_RE = re.compile(rb'"update_id"\s*:\s*\d+\s*,\s*"(\w+)"')
+_allowed_update_types = None # set of update type names from handlers.allowed_updates (None = all)
+_seen_update_ids = LRUCache(config.WEBHOOK_DEDUPE_SIZE)
+_raw_updates = None # asyncio.Queue of raw bodies, created in start_web_server
+_in_flight = 0 # Accepted updates not yet fully processed (queued + being handled)
+_webhook_task = None
+_runner = None
+
 async def telegram_webhook(request):
     """Receives messages directly from Telegram and feeds them to the bot."""
-    # Security: Verify the request contains our secret token in the URL
-    if request.path != f"/webhook_{config.TOKEN}":
+    # Security: Telegram echoes the secret_token we registered in this header
+    secret = request.headers.get('X-Telegram-Bot-Api-Secret-Token', '')
+    if not hmac.compare_digest(secret, config.WEBHOOK_SECRET):
+        metrics.inc('webhook_rejected_total')
         return web.Response(status=401)
-        
-    if _app_instance:
-        data = await request.json()
-        # Convert the JSON payload back into a Telegram Update object
-        update = Update.de_json(data=data, bot=_app_instance.bot)
-        # Feed it into the bot's internal processing queue
-        await _app_instance.update_queue.put(update)
-        
+
+    body = await request.read()
+
+    # Pre-filter: drop update types no handler uses before any parsing happens
+    if _allowed_update_types is not None:
+        match = _UPDATE_TYPE_RE.search(body, 0, 96)
+        if match:
+            update_type = match.group(1).decode()
+            if update_type not in _allowed_update_types:
+                metrics.inc('webhook_dropped_total', type=update_type)
+                return web.Response(text="OK")
+
+    match = _UPDATE_ID_RE.search(body, 0, 64)
+    update_id = int(match.group(1)) if match else None
+
+    # Telegram re-sends updates it thinks we missed: only process each one once
+    if update_id is not None and update_id in _seen_update_ids:
+        metrics.inc('webhook_duplicates_total')
+        return web.Response(text="OK")
+
+    global _in_flight
+    if _in_flight >= config.WEBHOOK_QUEUE_SIZE:
+        # Backpressure: a non-2xx makes Telegram hold the update and retry later
+        metrics.inc('webhook_overflow_total')
+        return web.Response(status=503)
+    _in_flight += 1
+    metrics.set_gauge('webhook_in_flight', _in_flight)
+    _raw_updates.put_nowait(body)
+
+    if update_id is not None:
+        _seen_update_ids.put(update_id)
+    metrics.inc('webhook_updates_total')
     return web.Response(text="OK")
 
+def _update_finished():
+    global _in_flight
+    _in_flight -= 1
+    metrics.set_gauge('webhook_in_flight', _in_flight)
+
+async def _process_update(update):
+    """Runs one update through the bot's update processor (what Application does for its update_queue)."""
+    try:
+        await _app_instance.update_processor.process_update(update, _app_instance.process_update(update))
+    finally:
+        _update_finished()
+
+async def _webhook_worker():
+    """Turns queued raw bodies into Update objects and hands them to the bot."""
+    while True:
+        body = await _raw_updates.get()
+        metrics.set_gauge('webhook_queue_depth', _raw_updates.qsize())
+        try:
+            # Convert the JSON payload back into a Telegram Update object
+            update = Update.de_json(data=json.loads(body), bot=_app_instance.bot)
+        except Exception as e:
+            print(f"❌ Bad webhook update: {e}")
+            _update_finished()
+            continue
+        finally:
+            _raw_updates.task_done()
+        # Tracked by the Application, so application.stop() waits for it to finish
+        _app_instance.create_task(_process_update(update), update=update)
+
+# --- Metrics ---
+async def serve_metrics(request):
+    """Prometheus-style metrics. Protected by METRICS_TOKEN when one is configured."""
+    if config.METRICS_TOKEN and not hmac.compare_digest(request.query.get('token', ''), config.METRICS_TOKEN):
+        return web.Response(status=401)
+    return web.Response(text=metrics.render(), content_type='text/plain')
+
 # --- MODIFIED: Startup Function ---
-async def start_web_server(application): # CHANGED: Accepts 'application' instead of 'bot'
-    global _bot_instance, _app_instance
+async def start_web_server(application, allowed_updates=None): # CHANGED: Accepts 'application' instead of 'bot'
+    global _bot_instance, _app_instance, _raw_updates, _webhook_task, _allowed_update_types, _runner
+    _allowed_update_types = set(allowed_updates) if allowed_updates is not None else None
     _app_instance = application
     _bot_instance = application.bot
+    _raw_updates = asyncio.Queue() # Bounded by the in-flight count in telegram_webhook
+    _webhook_task = asyncio.get_running_loop().create_task(_webhook_worker())
 
     app = web.Application()
     app.router.add_get('/', serve_index)
+    app.router.add_get(_static.url_prefix + '{name}', _static.handle)
     app.router.add_get('/api/wheel_data', get_wheel_data)
     app.router.add_post('/api/spin', spin_wheel)
+    app.router.add_get('/metrics', serve_metrics)
     
-    # NEW: Add the webhook listener (Using the token in the URL makes it unguessable)
-    app.router.add_post(f'/webhook_{config.TOKEN}', telegram_webhook)
+    # Webhook listener (authenticated by the secret token header, not the URL)
+    app.router.add_post('/webhook', telegram_webhook)
     
-    runner = web.AppRunner(app)
-    await runner.setup()
+    _runner = web.AppRunner(app)
+    await _runner.setup()
     
     port = int(os.getenv("PORT", 8080))
-    site = web.TCPSite(runner, '0.0.0.0', port)
+    site = web.TCPSite(_runner, '0.0.0.0', port)
     
     await site.start()
-    print(f"🌐 Web App Server & Webhook running on port {port}")
\ No newline at end of file
+    print(f"🌐 Web App Server & Webhook running on port {port}")
+
+async def stop_web_server():
+    """Stops listening, hands every body already accepted to the bot, then stops the worker."""
+    global _runner, _webhook_task
+    if _runner:
+        await _runner.cleanup()
+        _runner = None
+    if _webhook_task:
+        if not _webhook_task.done():
+            await _raw_updates.join()
+        _webhook_task.cancel()
+        _webhook_task = None
\ No newline at end of file